@@ -1,13 +1,21 @@
 import streamlit as st
-from streamlit_plotly_events import plotly_events
-import json
 
 from utils.data_loader import load_geojson, process_geojson
-from components.map import create_wahlkreis_map
-from components.results import display_wahlkreis_info
+from utils.geometry import DEFAULT_LEVEL, LEVELS
+from components.swing import create_swing_summary
+from components.wahlkreise import create_wahlkreis_section
 from components.legal import show_imprint, show_privacy
 from components.overview import create_overview
 from components.direct_candidates_vs_seats import create_direct_vs_total
+from components.land_seats import create_land_seats
+from components.land_view import create_land_view
+from components.timeline import create_timeline
+from components.figures import warm_snapshot_figures
+from components.live import watch_snapshots
+from components.memory import show_memory_report
+from components.debug import show_debug_panel
+from utils.metrics import begin_rerun
+from utils.snapshots import get_changed_districts, get_election_state
 
 # Page config
 st.set_page_config(
@@ -17,6 +25,15 @@ st.set_page_config(
 )
 st.title("Bundestagswahl 2025")
 
+# Timing spans of this rerun, with METRICS=1
+begin_rerun()
+
+# Build the figures of a new snapshot in the background
+warm_snapshot_figures()
+
+# Rerun when the fetcher publishes a new snapshot
+watch_snapshots(get_election_state().version)
+
 # Add overview section
 create_overview()
 
@@ -24,9 +41,12 @@ create_overview()
 st.markdown("---")
 
 # Load and process data
-geojson_str = load_geojson()
-geojson_data = json.loads(geojson_str)
-df = process_geojson(geojson_str)
+# Simplified map geometry, ?karte=full|high|medium|low picks another level
+map_level = st.query_params.get('karte', DEFAULT_LEVEL)
+if map_level != 'full' and map_level not in LEVELS:
+    map_level = DEFAULT_LEVEL
+geojson_data = load_geojson(map_level)
+df = process_geojson(geojson_data)
 
 # Initialize session state
 if 'selected_wahlkreis' not in st.session_state:
@@ -35,16 +55,18 @@ if 'selected_wahlkreis' not in st.session_state:
 # Create layout for map and details
 st.title("Wahlkreisergebnisse")
 
-col1, col2 = st.columns(2)
+# Districts that moved with the newest snapshot
+changed_districts = get_changed_districts()
+if changed_districts:
+    wkr_names = df.set_index('WKR_NR')['WKR_NAME']
+    with st.expander(f"{len(changed_districts)} Wahlkreise mit neuen Ergebnissen seit dem letzten Stand"):
+        st.write(", ".join(f"{nr} {wkr_names.get(nr, '')}" for nr in changed_districts))
 
-# Create and display map
-with col1:
-    fig, df_map = create_wahlkreis_map(df, geojson_data)
-    selected_points = plotly_events(fig, click_event=True, override_height=800)
+# Map and results of the clicked district, reruns on its own
+create_wahlkreis_section(df, geojson_data, map_level)
 
-# Display results
-with col2:
-    display_wahlkreis_info(df_map, selected_points)
+# Districts that changed hands since the previous election
+create_swing_summary()
 
 # Add separator
 st.markdown("---")
@@ -53,9 +75,29 @@ st.markdown("---")
 st.subheader("Vergleich: Direktmandate und Gesamtsitze")
 create_direct_vs_total()
 
+# Add seats per Land and Wahlkreis winners without a seat
+st.markdown("---")
+create_land_seats()
+
+# Add the results of one Land
+st.markdown("---")
+st.subheader("Ergebnisse nach Ländern")
+create_land_view()
+
+# Add the counting progress over all snapshots
+st.markdown("---")
+st.subheader("Verlauf der Auszählung")
+create_timeline()
+
 # Footer with legal info
 st.markdown("---")
 if st.button("Impressum"):
     show_imprint()
 if st.button("Datenschutzerklärung"):
-    show_privacy()
\ No newline at end of file
+    show_privacy()
+
+# Memory report, ?speicher
+show_memory_report()
+
+# Timings and cache counters, ?debug with METRICS=1
+show_debug_panel()
\ No newline at end of file
@@ -0,0 +1,84 @@
+# Work per interaction with the page split into fragments
+#
+# A click in the map or a toggle used to rerun all of app.py, now it only
+# reruns the fragment around the widget. The app is run with METRICS=1 and
+# ?debug (see utils/metrics.py), and the time of the whole rerun is
+# compared with the spans of the fragments each interaction reruns.
+#
+#     python -m benchmarks.interactions --runs 5
+
+import argparse
+import os
+import re
+import sys
+
+# Read by utils.metrics when it is imported
+os.environ['METRICS'] = '1'
+
+import numpy as np
+import pandas as pd
+
+# Interaction -> span of the fragment it reruns
+INTERACTIONS = {
+    'Klick in die Karte': 'create_wahlkreis_section',
+    'Prozentuale Ansicht / Stimmenart (Wahlkreis)': 'display_wahlkreis_info',
+    'Absolute Zahlen (Übersicht)': 'create_votes_column',
+    'Land / Stimmenart / Prozentuale Ansicht (Länder)': 'create_land_view',
+}
+
+
+def _click(wkr_nr):
+    # Selection state of the map as st.plotly_chart returns it
+    from streamlit.elements.lib.event_utils import AttributeDictionary
+    return AttributeDictionary({'selection': AttributeDictionary(
+        {'points': [{'location': wkr_nr}], 'point_indices': [wkr_nr - 1], 'box': [], 'lasso': []})})
+
+
+def _rerun_timings(at):
+    # Total rerun and top-level span times in ms from the debug panel
+    caption = next(c.value for c in at.caption if c.value.startswith('Durchlauf'))
+    total = float(re.search(r'(\d+) ms', caption).group(1))
+    spans = next(d.value for d in at.dataframe if 'Aufruf' in d.value.columns)
+    spans = spans.assign(Aufruf=spans['Aufruf'].str.lstrip('\u2003'))
+    return total, spans.groupby('Aufruf')['ms'].sum()
+
+
+def measure(runs=5, wkr_nr=1, script='app.py'):
+    """Median ms of a full rerun and of the fragment each interaction reruns"""
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(script, default_timeout=300)
+    at.query_params['debug'] = '1'
+    at.session_state['wahlkreis_map'] = _click(wkr_nr)
+    # Warm the caches and the figures of the views
+    at.run()
+    at.run()
+
+    totals, spans = [], []
+    for _ in range(runs):
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        total, span = _rerun_timings(at)
+        totals.append(total)
+        spans.append(span)
+    spans = pd.DataFrame(spans)
+
+    full = float(np.median(totals))
+    rows = [{'Interaktion': interaction, 'Vorher_ms': full, 'Fragment_ms': float(spans[name].median())}
+            for interaction, name in INTERACTIONS.items()]
+    table = pd.DataFrame(rows).set_index('Interaktion')
+    table['Anteil'] = table['Fragment_ms'] / table['Vorher_ms']
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Work per interaction with and without fragments")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--wahlkreis', type=int, default=1, help="WKR_NR of the clicked district")
+    args = parser.parse_args()
+
+    from streamlit.logger import set_log_level
+    set_log_level('error')
+    table = measure(args.runs, args.wahlkreis)
+    print(table.round({'Vorher_ms': 0, 'Fragment_ms': 1, 'Anteil': 3}).to_string(), file=sys.stderr)
@@ -0,0 +1,230 @@
+# Benchmarks of the data layer and the figure builders
+#
+# Times the loaders and computations on the real snapshots in results/ and
+# the data layer on synthetic snapshots of larger scales (see
+# benchmarks/synthetic.py). Results are written as JSON; with --compare the
+# run is checked against a stored baseline and exits with 1 on regressions.
+#
+#     python -m benchmarks.run --output baseline.json
+#     python -m benchmarks.run --scales 10x 100x gemeinde --compare baseline.json
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from streamlit.logger import set_log_level
+
+from benchmarks.synthetic import SCALES, synthetic_snapshot
+
+
+# A benchmark regresses if its median is this much slower than the baseline
+THRESHOLD = 1.25
+# and at least this many seconds slower, which hides timer noise
+MIN_DIFFERENCE = 0.001
+
+
+def timeit(func, setup=None, repeat=5, warmup=False):
+    """Median, min and mean seconds of func() over repeat runs.
+
+    setup() runs before every run and is not timed, e.g. to clear a cache.
+    """
+    if warmup:
+        func()
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'median': float(np.median(times)), 'min': min(times), 'mean': float(np.mean(times)), 'runs': repeat}
+
+
+def real_benchmarks():
+    """Benchmarks on the newest real snapshot, as name: (func, setup, warmup)"""
+    import utils.data_loader as data_loader
+    from components.map import create_wahlkreis_map
+    from components.results import display_wahlkreis_info
+    from utils.api import ApiServer, render_responses
+    from utils.figure_cache import get_figure_cache
+    from utils.geometry import DEFAULT_LEVEL
+    from utils.seats import calculate_seats, five_percent_rule, n_independent_mandates, seats_from_totals
+    from utils.snapshots import get_election_state
+    from utils.utils import get_winner_party
+
+    first_votes = data_loader.get_first_votes()
+    totals = data_loader.get_second_votes().groupby('Gruppenname', as_index=False, observed=True)['Anzahl'].sum()
+    winners = data_loader.get_district_winners()
+    geojson = data_loader.load_geojson(DEFAULT_LEVEL)
+    districts = data_loader.process_geojson(geojson)
+
+    benchmarks = {}
+    for name, cached in [('load_election_results', data_loader._load_election_results),
+                         ('get_first_votes', data_loader._get_first_votes),
+                         ('get_second_votes', data_loader._get_second_votes)]:
+        public = getattr(data_loader, name)
+        benchmarks[f'{name}[cold]'] = (public, cached.clear, False)
+        benchmarks[f'{name}[warm]'] = (public, None, True)
+    benchmarks['load_candidates[cold]'] = (data_loader.load_candidates, data_loader._load_candidates.clear, False)
+    benchmarks['load_candidates[warm]'] = (data_loader.load_candidates, None, True)
+    for level in ['full', DEFAULT_LEVEL]:
+        benchmarks[f'load_geojson[{level}]'] = (
+            lambda level=level: data_loader.load_geojson(level), data_loader.load_geometry.clear, False)
+    benchmarks['process_geojson'] = (lambda: data_loader.process_geojson(geojson), None, False)
+
+    benchmarks['calculate_seats'] = (calculate_seats, None, True)
+    benchmarks['seats_from_totals'] = (lambda: seats_from_totals(totals, winners), None, False)
+    benchmarks['n_independent_mandates'] = (lambda: n_independent_mandates(winners), None, False)
+    benchmarks['five_percent_rule'] = (lambda: five_percent_rule(totals, winners), None, False)
+    benchmarks['get_winner_party'] = (lambda: get_winner_party(first_votes), None, False)
+    benchmarks['create_wahlkreis_map'] = (
+        lambda: create_wahlkreis_map(districts, geojson, data_loader.geojson_size(DEFAULT_LEVEL),
+                                     get_election_state()), None, True)
+
+    figure_cache = get_figure_cache()
+    benchmarks['display_wahlkreis_info[cold]'] = (lambda: display_wahlkreis_info(1), figure_cache.clear, True)
+    benchmarks['display_wahlkreis_info[warm]'] = (lambda: display_wahlkreis_info(1), None, True)
+
+    state = get_election_state()
+    benchmarks['render_api_responses'] = (lambda: render_responses(state), None, False)
+    server = ApiServer(('127.0.0.1', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    benchmarks['api_requests[1000]'] = (lambda: api_requests(server, 1000), None, True)
+    return benchmarks
+
+
+def api_requests(server, n):
+    """n requests for district results over one keep-alive connection"""
+    connection = http.client.HTTPConnection(*server.server_address)
+    for i in range(n):
+        connection.request('GET', f'/api/wahlkreis/{i % 299 + 1}', headers={'Accept-Encoding': 'gzip'})
+        connection.getresponse().read()
+    connection.close()
+
+
+def synthetic_benchmarks(scale):
+    """Data layer benchmarks on a synthetic snapshot, as name: (func, setup, warmup)"""
+    from utils.candidates import attach_candidates, read_candidates
+    from utils.district_index import build_district_index
+    from utils.matrix import build_vote_matrix, find_winners, land_totals
+    from utils.seats import distribute_seats, seats_from_totals
+    from utils.store import parse_snapshot, read_snapshot
+
+    path = synthetic_snapshot(scale)
+
+    def first():
+        return read_snapshot(path, gebietsart='Wahlkreis', stimme=1, gruppenart=['Partei', 'Einzelbewerber/Wählergruppe'])
+
+    def second():
+        return read_snapshot(path, gebietsart='Wahlkreis', stimme=2, gruppenart=['Partei'])
+
+    candidates = read_candidates()
+    first_votes, second_votes = attach_candidates(first(), candidates), second()
+    first_matrix, second_matrix = build_vote_matrix(first_votes), build_vote_matrix(second_votes)
+    winners = find_winners(first_matrix)
+    totals = second_votes.groupby('Gruppenname', as_index=False, observed=True)['Anzahl'].sum()
+
+    return {
+        'parse_snapshot': (lambda: parse_snapshot(path), None, False),
+        'read_snapshot[first]': (first, None, False),
+        'read_snapshot[second]': (second, None, False),
+        'build_vote_matrix': (lambda: build_vote_matrix(first_votes), None, False),
+        'find_winners': (lambda: find_winners(first_matrix), None, False),
+        'land_totals': (lambda: land_totals(second_matrix), None, False),
+        'seats_from_totals': (lambda: seats_from_totals(totals, winners), None, False),
+        'distribute_seats': (lambda: distribute_seats(first_matrix, second_matrix, winners), None, False),
+        'attach_candidates': (lambda: attach_candidates(first_votes, candidates), None, False),
+        'build_district_index': (lambda: build_district_index(first_votes, second_votes, winners), None, False),
+    }
+
+
+def run(scales=(), repeat=5, match=None):
+    groups = [('real', real_benchmarks)] + [(scale, lambda scale=scale: synthetic_benchmarks(scale))
+                                            for scale in scales]
+    results = {}
+    for group, benchmarks in groups:
+        # Calling st functions outside of streamlit run logs a warning each
+        # time, streamlit resets the level when it reads its config
+        set_log_level('error')
+        benchmarks = benchmarks()
+        set_log_level('error')
+        for name, (func, setup, warmup) in benchmarks.items():
+            key = f'{group}/{name}'
+            if match and match not in key:
+                continue
+            results[key] = timeit(func, setup, repeat, warmup)
+            print(f"{key:<50} {results[key]['median'] * 1000:10.2f} ms", file=sys.stderr)
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Compare with the benchmarks of a baseline run, returns a frame and the regressed names"""
+    rows = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['median'], result['median']
+        rows.append({
+            'benchmark': name,
+            'baseline_ms': before * 1000,
+            'current_ms': after * 1000,
+            'ratio': after / before if before else np.inf,
+            'regression': after > before * threshold and after - before > MIN_DIFFERENCE,
+        })
+    table = pd.DataFrame(rows, columns=['benchmark', 'baseline_ms', 'current_ms', 'ratio', 'regression'])
+    return table.set_index('benchmark'), table.loc[table['regression'], 'benchmark'].tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmarks")
+    parser.add_argument('--scales', nargs='*', default=[], choices=list(SCALES),
+                        help="synthetic scales to run besides the real snapshots")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument('--output', default=None, help="write the results as JSON to this file")
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help="JSON of an earlier run")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    report = {'meta': metadata(), 'benchmarks': run(args.scales, args.repeat, args.filter)}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['benchmarks']
+        table, regressions = compare(report['benchmarks'], baseline, args.threshold)
+        print(table.round(2).to_string(), file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
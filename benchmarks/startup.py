@@ -0,0 +1,122 @@
+# Import time of the app at startup
+#
+# A new worker imports everything app.py imports before it can render the
+# first page. The import statements of app.py are run in a fresh
+# interpreter with -X importtime, repeated a few times, and the cumulative
+# time is reported per module imported by app.py and per package
+# (pandas, streamlit, ...). The libraries in LAZY are only needed off the
+# startup path and must not be imported by it.
+#
+#     python -m benchmarks.startup --output startup.json
+#     python -m benchmarks.startup --compare startup.json
+
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.run import THRESHOLD, compare, metadata
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported inside the functions that use them: geopandas and shapely to
+# rebuild the geometry artifact, plotly.express to build a figure that is
+# not cached yet, matplotlib and seaborn only in the notebook
+LAZY = ['geopandas', 'shapely', 'matplotlib', 'seaborn', 'plotly.express']
+
+# import time: self [us] | cumulative | imported package
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+# The standard library and the hooks run by site, not reported
+_SKIP = set(sys.stdlib_module_names) | {'sitecustomize', 'usercustomize'}
+
+
+def script_imports(script='app.py'):
+    """The top-level import statements of a script as code"""
+    with open(os.path.join(ROOT, script), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    return '\n'.join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def import_times(code):
+    """Seconds per module of one cold run of code, and the LAZY modules it imported"""
+    check = f'\nimport sys; print(sorted(set({LAZY!r}) & set(sys.modules)))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code + check],
+                            cwd=ROOT, capture_output=True, text=True, env={**os.environ, 'PYTHONPATH': ROOT})
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is None:
+            continue
+        cumulative, depth, name = int(match.group(2)) / 1e6, len(match.group(3)), match.group(4)
+        if name.startswith('_') or name.split('.')[0] in _SKIP:
+            continue
+        # The modules imported by the script itself, including everything
+        # they are the first to import
+        if depth == 1:
+            times[f'import/{name}'] = times.get(f'import/{name}', 0.0) + cumulative
+        # Third-party packages, wherever they are first imported
+        if '.' not in name and not os.path.isdir(os.path.join(ROOT, name)):
+            times[f'package/{name}'] = times.get(f'package/{name}', 0.0) + cumulative
+    times['total'] = sum(t for name, t in times.items() if name.startswith('import/'))
+    return times, ast.literal_eval(result.stdout.strip().splitlines()[-1])
+
+
+def profile(script='app.py', repeat=5):
+    """Median, min and mean import seconds per module over repeat cold runs, and the eager LAZY modules"""
+    code = script_imports(script)
+    runs, eager = [], set()
+    for _ in range(repeat):
+        times, loaded = import_times(code)
+        runs.append(times)
+        eager.update(loaded)
+    runs = pd.DataFrame(runs)
+    results = {name: {'median': float(np.median(column.dropna())), 'min': float(column.min()),
+                      'mean': float(column.mean()), 'runs': int(column.count())}
+               for name, column in runs.items()}
+    return results, sorted(eager)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of the app at startup")
+    parser.add_argument('--script', default='app.py')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="modules and packages to print")
+    parser.add_argument('--output', default=None, help="write the results as JSON to this file")
+    parser.add_argument('--compare', default=None, metavar='BASELINE', help="JSON of an earlier run")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    results, eager = profile(args.script, args.repeat)
+    report = {'meta': metadata(), 'benchmarks': results, 'eager': eager}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+    medians = pd.Series({name: result['median'] * 1000 for name, result in results.items()}, name='ms')
+    for prefix in ['import/', 'package/']:
+        print(medians[medians.index.str.startswith(prefix)].nlargest(args.top).round(1).to_string(), file=sys.stderr)
+    print(f"total {medians['total']:.0f} ms", file=sys.stderr)
+
+    failed = False
+    if eager:
+        print(f"imported at startup, should be lazy: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['benchmarks']
+        table, regressions = compare(results, baseline, args.threshold)
+        print(table.round(2).to_string(), file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} regressions: {', '.join(regressions)}", file=sys.stderr)
+            failed = True
+    if failed:
+        sys.exit(1)
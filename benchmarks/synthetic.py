@@ -0,0 +1,196 @@
+# Synthetic kerg2 snapshots for the benchmarks
+#
+# Writes files with the layout of the kerg2 results (same header, columns
+# and Gebietsarten) but with many more districts and parties than the real
+# election, to see how the data layer scales. The party names start with
+# the real ones, so CDU/CSU and the SSW get their usual special treatment.
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.store import newest_snapshot, read_snapshot
+
+DATA_DIR = 'benchmarks/data'
+
+# Scale name: (number of districts, number of parties)
+SCALES = {
+    '10x': (2990, 60),
+    '100x': (29900, 60),
+    # Roughly one area per Gemeinde
+    'gemeinde': (10800, 150),
+}
+
+# Parties beyond the eight largest only run for first votes in this share
+# of the districts, like the small parties in the real data
+FIRST_VOTE_SHARE = 0.3
+
+# Share of districts with an Einzelbewerber, each one is a party column of
+# its own in the vote matrix
+EB_SHARE = 0.01
+
+COLUMNS = ['Wahlart', 'Wahltag', 'Gebietsart', 'Gebietsnummer', 'Gebietsname', 'UegGebietsart', 'UegGebietsnummer',
+           'Gruppenart', 'Gruppenname', 'Gruppenreihenfolge', 'Stimme', 'Anzahl', 'Prozent', 'VorpAnzahl',
+           'VorpProzent', 'DiffProzent', 'DiffProzentPkt', 'Bemerkung', 'Gewählt']
+
+
+def _real_parties():
+    # Parties of the real election with their national second vote share
+    bund = read_snapshot(newest_snapshot(), gebietsart='Bund', stimme=2, gruppenart=['Partei'])
+    bund = bund.dropna(subset=['Anzahl']).sort_values('Gruppenreihenfolge')
+    return bund['Gruppenname'].tolist(), (bund['Anzahl'] / bund['Anzahl'].sum()).to_numpy()
+
+
+def _real_lands():
+    # Number of Wahlkreise and name of every Land
+    wahlkreise = read_snapshot(newest_snapshot(), gebietsart='Wahlkreis', stimme=2, gruppenart=['Partei'])
+    counts = wahlkreise.drop_duplicates('Gebietsnummer')['UegGebietsnummer'].value_counts().sort_index()
+    lands = read_snapshot(newest_snapshot(), gebietsart='Land').drop_duplicates('Gebietsnummer')
+    return counts.to_numpy(), lands.set_index('Gebietsnummer')['Gebietsname'].sort_index().tolist()
+
+
+def generate_votes(n_districts, n_parties, counted_share=1.0, seed=0):
+    """Wahlkreis rows of a synthetic snapshot as a frame with the kerg2 columns"""
+    rng = np.random.default_rng(seed)
+
+    names, real_shares = _real_parties()
+    n_real = min(len(names), n_parties)
+    names = names[:n_real] + [f'Partei {i}' for i in range(n_real + 1, n_parties + 1)]
+    # Small parties get a long tail of shares below one percent
+    weights = np.concatenate([real_shares[:n_real], 0.005 / np.arange(1, n_parties - n_real + 1)])
+    weights /= weights.sum()
+
+    # Districts in Land order, with as many per Land as in the real election
+    land_counts, _ = _real_lands()
+    land_districts = np.round(land_counts / land_counts.sum() * n_districts).astype(int)
+    land_districts[-1] += n_districts - land_districts.sum()
+    lands = np.repeat(np.arange(1, 17), land_districts)
+
+    # Regional parties only run in their Land
+    weights = np.tile(weights, (n_districts, 1))
+    for party, land, only in [('CSU', 9, True), ('CDU', 9, False), ('SSW', 1, True)]:
+        if party in names:
+            col = names.index(party)
+            weights[:, col] *= (lands == land) if only else (lands != land)
+
+    shares = rng.gamma(weights * 200 + 1e-9)
+    shares /= shares.sum(axis=1, keepdims=True)
+    valid = 46_400_000 / n_districts * rng.lognormal(0, 0.1, n_districts)
+    second = np.round(shares * valid[:, None])
+    first = np.round(rng.gamma(shares * 100 + 1e-9) / 100 * valid[:, None])
+
+    # Small parties only run for first votes in some districts
+    runs = np.zeros_like(first, dtype=bool)
+    runs[:, np.argsort(-weights.mean(axis=0))[:8]] = True
+    runs |= rng.random(first.shape) < FIRST_VOTE_SHARE
+    runs &= weights > 0
+
+    district_nr = np.arange(1, n_districts + 1)
+    counted = rng.random(n_districts) < counted_share
+
+    frames = []
+    for stimme, votes, mask in [(1, first, runs), (2, second, weights > 0)]:
+        rows, cols = np.nonzero(mask)
+        frames.append(pd.DataFrame({
+            'Gebietsnummer': district_nr[rows],
+            'UegGebietsnummer': lands[rows],
+            'Gruppenart': 'Partei',
+            'Gruppenname': np.asarray(names, dtype=object)[cols],
+            'Gruppenreihenfolge': cols + 1,
+            'Stimme': stimme,
+            'Anzahl': votes[rows, cols],
+        }))
+
+    # Einzelbewerber, each with its own name
+    eb = np.flatnonzero(rng.random(n_districts) < EB_SHARE)
+    frames.append(pd.DataFrame({
+        'Gebietsnummer': district_nr[eb],
+        'UegGebietsnummer': lands[eb],
+        'Gruppenart': 'Einzelbewerber/Wählergruppe',
+        'Gruppenname': [f'EB:Bewerber {nr}' for nr in district_nr[eb]],
+        'Gruppenreihenfolge': 1000,
+        'Stimme': 1,
+        'Anzahl': np.round(valid[eb] * rng.uniform(0.01, 0.4, len(eb))),
+    }))
+
+    votes = pd.concat(frames, ignore_index=True)
+
+    # System-Gruppe rows with the totals per district
+    totals = votes.groupby(['Gebietsnummer', 'UegGebietsnummer', 'Stimme'], as_index=False)['Anzahl'].sum()
+    invalid = np.round(totals['Anzahl'] * 0.006)
+    electorate = totals[totals['Stimme'] == 1].assign(Stimme=np.nan)
+    system = pd.concat([
+        electorate.assign(Gruppenname='Wahlberechtigte', Gruppenreihenfolge=-4,
+                          Anzahl=np.round(electorate['Anzahl'] / 0.82)),
+        electorate.assign(Gruppenname='Wählende', Gruppenreihenfolge=-3,
+                          Anzahl=np.round(electorate['Anzahl'] * 1.006)),
+        totals.assign(Gruppenname='Ungültige', Gruppenreihenfolge=-2, Anzahl=invalid),
+        totals.assign(Gruppenname='Gültige', Gruppenreihenfolge=-1),
+    ]).assign(Gruppenart='System-Gruppe')
+
+    votes = pd.concat([system, votes], ignore_index=True)
+    votes['VorpAnzahl'] = np.round(votes['Anzahl'] * rng.lognormal(0, 0.2, len(votes)))
+    votes.loc[~counted[votes['Gebietsnummer'] - 1], 'Anzahl'] = np.nan
+    return votes.sort_values(['Gebietsnummer', 'Gruppenreihenfolge', 'Stimme'], kind='stable', ignore_index=True)
+
+
+def _with_columns(votes, gebietsart, names, ueg_gebietsart):
+    votes = votes.assign(
+        Wahlart='BT', Wahltag='23.02.2025', Gebietsart=gebietsart,
+        Gebietsname=votes['Gebietsnummer'].map(names), UegGebietsart=ueg_gebietsart,
+    )
+    return votes.reindex(columns=COLUMNS)
+
+
+def generate_snapshot(path, n_districts, n_parties, counted_share=1.0, seed=0):
+    """Write a synthetic kerg2 file with Wahlkreis, Land and Bund rows"""
+    wahlkreise = generate_votes(n_districts, n_parties, counted_share, seed)
+    _, land_names = _real_lands()
+
+    # Land and Bund rows are the sums of the districts, like in the real files
+    keys = ['Gruppenart', 'Gruppenname', 'Gruppenreihenfolge', 'Stimme']
+    lands = wahlkreise.groupby(['UegGebietsnummer'] + keys, dropna=False, as_index=False)[
+        ['Anzahl', 'VorpAnzahl']].sum(min_count=1)
+    lands = lands.rename(columns={'UegGebietsnummer': 'Gebietsnummer'}).assign(UegGebietsnummer=99)
+    lands = lands.sort_values(['Gebietsnummer', 'Gruppenreihenfolge', 'Stimme'], kind='stable')
+    bund = lands.groupby(keys, dropna=False, as_index=False)[['Anzahl', 'VorpAnzahl']].sum(min_count=1)
+    bund = bund.assign(Gebietsnummer=99, UegGebietsnummer=np.nan).sort_values(['Gruppenreihenfolge', 'Stimme'])
+
+    rows = pd.concat([
+        _with_columns(bund, 'Bund', {99: 'Bundesgebiet'}, np.nan),
+        _with_columns(lands, 'Land', dict(enumerate(land_names, start=1)), 'BUND'),
+        _with_columns(wahlkreise, 'Wahlkreis', lambda nr: f'Gebiet {nr}', 'LAND'),
+    ], ignore_index=True)
+    for column in ['Gebietsnummer', 'UegGebietsnummer', 'Gruppenreihenfolge', 'Stimme', 'Anzahl', 'VorpAnzahl']:
+        rows[column] = rows[column].astype('Int64')
+
+    # Same preamble as the real files, the header is on line 10
+    with open(newest_snapshot(), encoding='utf-8-sig') as f:
+        preamble = [next(f) for _ in range(9)]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        f.writelines(preamble)
+        rows.to_csv(f, sep=';', index=False, lineterminator='\n')
+    return path
+
+
+def synthetic_snapshot(scale, counted_share=1.0, data_dir=DATA_DIR):
+    """Path of the synthetic snapshot of a scale, generated on first use"""
+    path = os.path.join(data_dir, scale, 'kerg2_00001.csv' if counted_share == 1.0
+                        else f'kerg2_{round(counted_share * 100):05d}.csv')
+    if not os.path.exists(path):
+        n_districts, n_parties = SCALES[scale]
+        generate_snapshot(path, n_districts, n_parties, counted_share)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic kerg2 snapshots")
+    parser.add_argument('scales', nargs='*', default=list(SCALES), choices=list(SCALES))
+    parser.add_argument('--counted', type=float, default=1.0, help="share of districts with results")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+    for scale in args.scales:
+        print(synthetic_snapshot(scale, args.counted, args.data_dir))
@@ -0,0 +1,25 @@
+import pandas as pd
+import streamlit as st
+from utils.figure_cache import get_figure_cache
+from utils.metrics import ENABLED, REGISTRY, rerun_seconds, rerun_spans, write_metrics
+
+
+def show_debug_panel():
+    """Spans of this rerun and the cache counters, shown with ?debug when METRICS is on"""
+    if not ENABLED:
+        return
+    figure_cache = get_figure_cache()
+    write_metrics(figure_cache=figure_cache)
+    if 'debug' not in st.query_params:
+        return
+
+    with st.expander("Laufzeiten", expanded=True):
+        st.caption(f"Durchlauf bis hier: {rerun_seconds() * 1000:.0f} ms")
+        # Nested calls are indented below the call they belong to
+        spans = pd.DataFrame([{'Aufruf': '\u2003' * depth + name, 'ms': seconds * 1000}
+                              for name, depth, seconds in rerun_spans()], columns=['Aufruf', 'ms'])
+        st.dataframe(spans.round(1), hide_index=True, use_container_width=True)
+
+        counters = REGISTRY.cache_counters()
+        counters['Abbildungen'] = (figure_cache.hits, figure_cache.misses)
+        st.dataframe(pd.DataFrame.from_dict(counters, orient='index', columns=['Treffer', 'Fehlzugriffe']))
@@ -1,22 +1,21 @@
 import streamlit as st
-from utils.seats import calculate_seats
-from utils.data_loader import get_first_votes
-from utils.utils import get_winner_party
+from utils.snapshots import get_election_state
 import pandas as pd
-import plotly.express as px
 from components.map import party_to_color
+from utils.figure_cache import cached_figure
+from utils.metrics import timed
 
-def create_direct_vs_total():
-    """Create comparison of direct mandates vs total seats"""
+def create_direct_vs_total_figure(state):
+    """Bar plot of the direct mandates and the total seats per party of an election state"""
+    import plotly.express as px
     
     # Get seats and direct winners
-    seats = calculate_seats()
-    votes = get_first_votes()
+    seats = state.seats.copy()
     
     # Calculate direct winners
-    direct_winners = get_winner_party(votes)
+    direct_winners = state.district_winners['label']
     direct_winners = direct_winners.value_counts().to_frame().reset_index().rename(
-        columns={'index': 'Gruppenname', 'count': 'Sitze'}
+        columns={'label': 'Gruppenname', 'count': 'Sitze'}
     )
     
     # Combine CDU and CSU in direct winners
@@ -60,6 +59,14 @@ def create_direct_vs_total():
         legend_title='Partei'
     )
     
+    return fig
+
+@timed()
+def create_direct_vs_total():
+    """Create comparison of direct mandates vs total seats"""
+    state = get_election_state()
+    fig = cached_figure((state.key, 'direct_vs_total'), lambda: create_direct_vs_total_figure(state))
+
     # Display the plot
     st.plotly_chart(fig, use_container_width=True)
 
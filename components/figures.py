@@ -0,0 +1,47 @@
+# Figures of a snapshot that are built ahead of the first visitor
+#
+# The keys match the ones the components use with figure_cache.cached_figure.
+
+from components.direct_candidates_vs_seats import create_direct_vs_total_figure
+from components.map import create_wahlkreis_map
+from components.overview import create_seats_figure, create_votes_figure
+from components.results import create_votes_plot
+from utils.data_loader import geojson_size, load_geojson, process_geojson
+from utils.district_index import get_district_index
+from utils.figure_cache import warm_figures
+from utils.geometry import DEFAULT_LEVEL
+from utils.snapshots import get_election_state
+
+# At most this many districts with new results get their plot warmed
+MAX_WARM_DISTRICTS = 50
+
+
+def _map_figure(level, state):
+    geojson_data = load_geojson(level)
+    return create_wahlkreis_map(process_geojson(geojson_data), geojson_data, geojson_size(level), state)[0]
+
+
+def figure_builders(state, districts=()):
+    """Builders of the default views of an election state, keyed like in the components"""
+    snapshot, key = state.snapshot, state.key
+    builders = {
+        (key, 'overview', False): lambda: create_votes_figure(False, snapshot),
+        (key, 'overview', True): lambda: create_votes_figure(True, snapshot),
+        (key, 'seats'): lambda: create_seats_figure(state),
+        (key, 'map', DEFAULT_LEVEL): lambda: _map_figure(DEFAULT_LEVEL, state),
+        (key, 'direct_vs_total'): lambda: create_direct_vs_total_figure(state),
+    }
+    # First votes in absolute numbers, the view shown after a click
+    for nr in districts:
+        def build(nr=nr):
+            votes = get_district_index(snapshot)[nr].first_votes
+            return create_votes_plot(votes, False, 'Erststimmen nach Partei (Top 8)')
+        builders[(key, 'votes', nr, 'Erststimmen', False)] = build
+    return builders
+
+
+def warm_snapshot_figures():
+    """Warm the figure cache for the newest snapshot in the background"""
+    state = get_election_state()
+    districts = state.changed_districts[:MAX_WARM_DISTRICTS]
+    return warm_figures(state.key, figure_builders(state, districts))
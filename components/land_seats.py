@@ -0,0 +1,45 @@
+import streamlit as st
+from utils.candidates import attach_candidates
+from utils.data_loader import load_candidates
+from utils.metrics import timed
+from utils.seats import calculate_seat_distribution
+from utils.snapshots import get_election_state
+
+
+@timed()
+def create_land_seats():
+    """Show the seats per Land and the Wahlkreis winners without a seat"""
+
+    # The snapshot of the election state, like the rest of the page
+    distribution = calculate_seat_distribution(get_election_state().snapshot)
+
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("Sitze nach Ländern")
+        seats = distribution.seats.copy()
+        seats['Gesamt'] = seats.sum(axis=1)
+        st.dataframe(seats, use_container_width=True)
+
+    with col2:
+        st.subheader("Wahlkreisgewinner ohne Mandat")
+        uncovered = distribution.uncovered
+        if uncovered.empty:
+            st.write("Alle Wahlkreisgewinner sind durch Zweitstimmen gedeckt.")
+            return
+
+        # Add the names of the candidates and districts
+        uncovered = attach_candidates(uncovered, load_candidates(), columns=['Gebietsname', 'Name'])
+        uncovered['Anteil'] = uncovered['Anteil'].map(lambda x: f'{x:.1f}%')
+
+        st.write(f"{len(uncovered)} Wahlkreisgewinner erhalten keinen Sitz, weil die Zweitstimmen ihrer Partei im Land nicht ausreichen.")
+        st.dataframe(
+            uncovered[['Gebietsnummer', 'Gebietsname', 'Name', 'Gruppenname', 'Land', 'Anteil']].rename(columns={
+                'Gebietsnummer': 'WKR',
+                'Gebietsname': 'Wahlkreis',
+                'Gruppenname': 'Partei',
+                'Anteil': 'Erststimmen'
+            }),
+            hide_index=True,
+            use_container_width=True
+        )
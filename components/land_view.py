@@ -0,0 +1,59 @@
+import streamlit as st
+from components.results import create_votes_plot
+from utils.figure_cache import cached_figure
+from utils.metrics import timed
+from utils.rollup import get_rollup
+from utils.seats import LAENDER, calculate_seat_distribution
+from utils.snapshots import get_election_state
+
+
+@st.fragment
+@timed()
+def create_land_view():
+    """Show the votes and seats of one Land, its widgets only rerun this view"""
+    state = get_election_state()
+    snapshot = state.snapshot
+    cube = get_rollup(snapshot)
+
+    if not cube.mismatches.empty:
+        st.warning(f"{len(cube.mismatches)} Landes- oder Bundesergebnisse weichen von der Summe ihrer Wahlkreise ab.")
+
+    lands = cube.areas('Land')
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        land = st.selectbox("Land", list(lands), format_func=lands.get, key='land_view_land')
+    with col2:
+        vote_type = st.radio(
+            "Stimmenart",
+            ["Erststimmen", "Zweitstimmen"],
+            index=1,
+            horizontal=True,
+            label_visibility="collapsed",
+            key='land_view_vote_type'
+        )
+    with col3:
+        show_percentage = st.toggle('Prozentuale Ansicht', value=False, key='land_view_percentage')
+
+    stimme = 1 if vote_type == "Erststimmen" else 2
+    votes = cube.land(land, stimme)
+    if votes.sum() == 0:
+        st.info("Die Stimmen werden noch ausgezählt.")
+        return
+
+    col1, col2 = st.columns([2, 1])
+    with col1:
+        fig = cached_figure(
+            (state.key, 'land', land, stimme, show_percentage),
+            lambda: create_votes_plot(
+                votes.rename('Anzahl').rename_axis('Gruppenname').reset_index()
+                .sort_values('Anzahl', ascending=False, kind='stable'),
+                show_percentage, f'{vote_type} in {lands[land]} nach Partei (Top 8)'
+            )
+        )
+        st.plotly_chart(fig)
+
+    with col2:
+        seats = calculate_seat_distribution(snapshot).seats[LAENDER[land]]
+        seats = seats[seats > 0].sort_values(ascending=False)
+        st.write(f"Sitze aus {lands[land]}: {seats.sum()}")
+        st.dataframe(seats.rename('Sitze'), use_container_width=True)
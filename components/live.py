@@ -0,0 +1,14 @@
+import streamlit as st
+from utils.snapshots import get_election_state
+
+# Seconds between the checks for a new snapshot
+WATCH_INTERVAL = 15
+
+
+@st.fragment(run_every=WATCH_INTERVAL)
+def watch_snapshots(shown_version):
+    """Rerun the whole app once the state of a newer snapshot than shown_version is ready"""
+    # Lists results/ and starts building the state of a new snapshot in
+    # the background, the app itself is not rerun while nothing changes
+    if get_election_state().version != shown_version:
+        st.rerun()
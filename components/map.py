@@ -1,22 +1,91 @@
-import plotly.express as px
-from utils.data_loader import get_first_votes
-from utils.utils import get_winner_party, party_to_color
+import numpy as np
+import pandas as pd
+from utils.candidates import attach_candidates
+from utils.data_loader import get_vote_matrix, load_candidates
+from utils.matrix import top_shares
+from utils.metrics import timed
+from utils.swing import get_swing
+from utils.utils import party_to_color
 
 
-def create_wahlkreis_map(df, geojson_data):
-    votes = get_first_votes()
-    winners = get_winner_party(votes)
+# Parties per Stimme in the hover, fewer if the hover data would take more
+# than HOVER_BUDGET of the GeoJSON's size
+HOVER_PARTIES = 3
+HOVER_BUDGET = 0.1
+
+
+def hover_details(wkr_nrs, state, geojson_size):
+    """Hover data per WKR_NR: winning candidate, margin and top parties of both Stimmen.
+
+    Returns the frame and the number of parties per Stimme, as many as fit
+    into HOVER_BUDGET of geojson_size (see data_loader.geojson_size).
+    """
+    first = get_vote_matrix(1, state.snapshot)
+    second = get_vote_matrix(2, state.snapshot)
+    winners = state.district_winners['winner'].reindex(first.districts).fillna('').to_numpy()
+    names = attach_candidates(pd.DataFrame({'Gebietsnummer': first.districts, 'Gruppenname': winners}),
+                              load_candidates(), columns=['Name'])['Name']
+
+    first_parties, first_shares = top_shares(first, HOVER_PARTIES)
+    second_parties, second_shares = top_shares(second, HOVER_PARTIES)
+    # Rows of the second votes in the order of the first
+    second_rows = pd.Index(second.districts).get_indexer(first.districts)
+    runner_up = np.nan_to_num(first_shares[:, 1]) if first_shares.shape[1] > 1 else 0
+    base = {
+        'Bewerber': names.fillna('').to_numpy(),
+        'Vorsprung': np.round(first_shares[:, 0] - runner_up, 1),
+    }
+    budget = HOVER_BUDGET * geojson_size
+
+    for n_top in range(HOVER_PARTIES, 0, -1):
+        columns = dict(base)
+        for stimme, parties, shares in [(1, first_parties, first_shares),
+                                        (2, second_parties[second_rows], second_shares[second_rows])]:
+            for i in range(min(n_top, parties.shape[1])):
+                columns[f'P{stimme}{i}'] = parties[:, i]
+                columns[f'A{stimme}{i}'] = np.round(shares[:, i], 1)
+        details = pd.DataFrame(columns, index=pd.Index(first.districts, name='WKR_NR')).reindex(wkr_nrs)
+        if n_top == 1 or len(details.to_json(orient='values', force_ascii=False)) <= budget:
+            return details, n_top
+
+
+def _hover_template(party, n_top):
+    # customdata: WKR_NAME, Bewerber, Vorsprung, then party and share of
+    # the top n_top parties for the first and then the second votes
+    lines = ["<b>%{customdata[0]}</b> (WKR %{location}), ausgezählt",
+             f"%{{customdata[1]}} ({party}), Vorsprung %{{customdata[2]:.1f}} Pp."]
+    column = 3
+    for title in ["Erststimmen", "Zweitstimmen"]:
+        parties = []
+        for _ in range(n_top):
+            parties.append(f"%{{customdata[{column}]}} %{{customdata[{column + 1}]:.1f}} %")
+            column += 2
+        lines.append(f"{title}: " + ", ".join(parties))
+    return "<br>".join(lines) + "<extra></extra>"
+
+
+@timed()
+def create_wahlkreis_map(df, geojson_data, geojson_size, state, swing_party=None):
+    """Map of the district winners of an election state, or of the Zweitstimmen swing of swing_party.
+
+    geojson_size is the length of geojson_data as compact JSON, see
+    data_loader.geojson_size.
+    """
+    import plotly.express as px
+
+    winners = state.district_winners['label']
     
     # Create a copy and sort by WKR_NR to ensure consistent ordering
     df_map = df.copy().sort_values('WKR_NR')
     df_map['winner'] = df_map['WKR_NR'].map(winners)
+
+    if swing_party is not None:
+        return create_swing_map(df_map, geojson_data, get_swing(2, state.snapshot).party_swing(swing_party))
     
-    # Create hover text
-    df_map['hover_text'] = df_map.apply(
-        lambda x: f"{x['WKR_NAME']}<br>WKR {x['WKR_NR']}<br>{x['winner']}", 
-        axis=1
-    )
-    
+    # Results of every district for the hover, so reading them needs no click
+    details, n_top = hover_details(df_map['WKR_NR'], state, geojson_size)
+    df_map = df_map.join(details, on='WKR_NR')
+
     fig = px.choropleth_mapbox(
         data_frame=df_map,
         geojson=geojson_data,
@@ -28,20 +97,79 @@ def create_wahlkreis_map(df, geojson_data):
         zoom=5,
         center={"lat": 51.1657, "lon": 10.4515},
         opacity=0.7,
-        hover_name='hover_text'  # Use our custom hover text
+        custom_data=['WKR_NAME'] + list(details.columns)
     )
 
-    # Simplify hover template
     fig.update_traces(
-        hovertemplate="%{hovertext}<extra></extra>",
         marker_line_width=1,
         marker_line_color='white'
     )
+    for trace in fig.data:
+        if trace.name == 'Keine Ergebnisse':
+            # Only the name is shown, the rest of the row would be empty
+            trace.customdata = [row[:1] for row in trace.customdata]
+            trace.hovertemplate = "<b>%{customdata[0]}</b> (WKR %{location})<br>noch nicht ausgezählt<extra></extra>"
+        else:
+            trace.hovertemplate = _hover_template(trace.name, n_top)
+
+    # px puts the whole GeoJSON into every trace (one per winning party),
+    # give each trace only the districts it shows
+    features = {f['properties']['WKR_NR']: f for f in geojson_data['features']}
+    for trace in fig.data:
+        trace.geojson = {'type': 'FeatureCollection', 'features': [features[nr] for nr in trace.locations]}
 
     fig.update_layout(
         margin={"r":0,"t":0,"l":0,"b":0},
         height=800,
-        showlegend=False
+        showlegend=False,
+        # German decimal comma in the hover
+        separators=',.'
     )
     
-    return fig, df_map 
\ No newline at end of file
+    return fig, df_map 
+
+def create_swing_map(df_map, geojson_data, swing):
+    """Map of the swing of one party in percentage points"""
+    import plotly.express as px
+
+    df_map['swing'] = df_map['WKR_NR'].map(swing)
+    df_map['hover_text'] = df_map.apply(
+        lambda x: f"{x['WKR_NAME']}<br>WKR {x['WKR_NR']}<br>{swing.name}: " + (
+            'noch nicht ausgezählt' if pd.isna(x['swing']) else f"{x['swing']:+.1f}".replace('.', ',') + ' Pp.'),
+        axis=1
+    )
+    limit = max(df_map['swing'].abs().max(), 1) if df_map['swing'].notna().any() else 1
+
+    fig = px.choropleth_mapbox(
+        data_frame=df_map,
+        geojson=geojson_data,
+        locations='WKR_NR',
+        featureidkey="properties.WKR_NR",
+        color='swing',
+        color_continuous_scale='RdBu',
+        range_color=(-limit, limit),
+        mapbox_style="carto-positron",
+        zoom=5,
+        center={"lat": 51.1657, "lon": 10.4515},
+        opacity=0.7,
+        hover_name='hover_text'
+    )
+    fig.update_traces(
+        hovertemplate="%{hovertext}<extra></extra>",
+        marker_line_width=1,
+        marker_line_color='white'
+    )
+    fig.update_layout(
+        margin={"r":0,"t":0,"l":0,"b":0},
+        height=800,
+        coloraxis_colorbar=dict(title='Pp.')
+    )
+    return fig, df_map
+
+def selected_wahlkreis(event):
+    """WKR_NR of the district clicked in the map, None if nothing is selected"""
+    points = event.selection.points if event else []
+    if not points:
+        return None
+    # Every point carries its location, the WKR_NR of the district
+    return int(points[0]['location'])
@@ -0,0 +1,16 @@
+import streamlit as st
+from utils.memory import process_memory, session_memory, shared_memory
+
+
+def show_memory_report():
+    """Memory of the shared data and of this session, shown with ?speicher"""
+    if 'speicher' not in st.query_params:
+        return
+    with st.expander("Speicher"):
+        resident, peak = process_memory()
+        shared = shared_memory()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Prozess (RSS)", f"{resident / 2**20:.0f} MB", help=f"Höchstwert {peak / 2**20:.0f} MB")
+        col2.metric("Geteilte Daten", f"{shared.sum() / 2**20:.1f} MB")
+        col3.metric("Diese Sitzung", f"{session_memory(st.session_state) / 2**10:.1f} kB")
+        st.dataframe((shared / 2**20).round(2).rename('MB'))
@@ -1,14 +1,18 @@
 import streamlit as st
-from utils.data_loader import get_first_votes, get_second_votes, load_candidates
-import plotly.express as px
 from components.map import party_to_color
-import pandas as pd
+from utils.district_index import get_district_index
+from utils.figure_cache import cached_figure
+from utils.metrics import timed
+from utils.snapshots import get_election_state
 
 
 def create_votes_plot(votes_data, show_percentage, title):
     """Create a bar plot for vote data"""
+    import plotly.express as px
+
     # Get top 8 parties by votes
-    top_8_votes = votes_data.head(8)
+    # As floats, parties without votes (<NA> in the data layer) show as NaN
+    top_8_votes = votes_data.head(8).astype({'Anzahl': float})
     
     # Calculate percentages
     total_votes = votes_data['Anzahl'].sum()
@@ -58,39 +62,22 @@ def create_votes_plot(votes_data, show_percentage, title):
     
     return fig
 
-def display_wahlkreis_info(df_map, selected_points):
+@timed()
+def display_wahlkreis_info(selected_wkr_nr):
     """Display information for selected Wahlkreis"""
-    if not selected_points:
-        st.info("💡 Tipp: Klicken Sie auf einen Wahlkreis in der Karte, um detaillierte Ergebnisse anzuzeigen.")
+    if selected_wkr_nr is None:
+        st.info("💡 Tipp: Fahren Sie über einen Wahlkreis in der Karte, um die wichtigsten Zahlen zu sehen, "
+                "oder klicken Sie darauf, um detaillierte Ergebnisse anzuzeigen.")
         return
-        
-    # Get the WKR_NR from the customdata
-    curve_number = selected_points[0]['curveNumber']
-    point_number = selected_points[0]['pointNumber']
-    
-    # Find the corresponding row in df_map
-    unique_winners = df_map['winner'].unique()
-    winner_color = unique_winners[curve_number]
-    selected_row = df_map[df_map['winner'] == winner_color].iloc[point_number]
-    
-    selected_wkr_nr = selected_row['WKR_NR']
-    selected_wkr_name = selected_row['WKR_NAME']
-    
-    st.session_state.selected_wahlkreis = selected_wkr_nr
 
-    # Load candidates data
-    candidates = load_candidates()
+    st.session_state.selected_wahlkreis = selected_wkr_nr
 
-    # Filter candidates by WKR_NR
-    candidates_wkr = candidates[(candidates['Gebietsnummer'] == selected_wkr_nr) & 
-                                (candidates['Kennzeichen'].isin(['Kreiswahlvorschlag','anderer Kreiswahlvorschlag']))]
-    
-    st.subheader(f"Wahlkreis {selected_wkr_nr}: {selected_wkr_name}")
-    st.write(f"Gewinner: {winner_color}")
+    # Precomputed, sorted and labelled results of the district
+    state = get_election_state()
+    result = get_district_index(state.snapshot)[selected_wkr_nr]
 
-    # Get both types of votes
-    first_votes = get_first_votes()
-    second_votes = get_second_votes()
+    st.subheader(f"Wahlkreis {selected_wkr_nr}: {result.name}")
+    st.write(f"Gewinner: {result.winner}")
 
     # Add view options
     col1, col2 = st.columns(2)
@@ -105,23 +92,15 @@ def display_wahlkreis_info(df_map, selected_points):
         )
 
     # Select correct vote data based on radio selection
-    if vote_type == "Erststimmen":
-        votes = first_votes
-        # merge with candidates data
-        candidates_wkr = candidates_wkr[['GruppennameKurz', 'Rufname', 'Nachname']]
-        votes = pd.merge(votes, candidates_wkr, left_on='Gruppenname', right_on='GruppennameKurz', how='left')
-        votes['label'] = votes['Rufname'] + ' ' + votes['Nachname'] + ' (' + votes['Gruppenname'] + ')'
-    else:
-        votes = second_votes
-    
-    # filter by wkr_nr and sort by votes
-    wkr_votes = votes[votes['Gebietsnummer'] == selected_wkr_nr].sort_values('Anzahl', ascending=False)
+    wkr_votes = result.first_votes if vote_type == "Erststimmen" else result.second_votes
     
     if wkr_votes.empty or wkr_votes['Anzahl'].sum() == 0:
         st.info("Die Stimmen werden noch ausgezählt. Die Ergebnisse werden angezeigt, sobald sie vom Bundeswahlleiter freigegeben wurden.")
         return
 
     # Create and display plot
-    title = f'{vote_type} nach Partei (Top 8)'
-    fig = create_votes_plot(wkr_votes, show_percentage, title)
+    fig = cached_figure(
+        (state.key, 'votes', selected_wkr_nr, vote_type, show_percentage),
+        lambda: create_votes_plot(wkr_votes, show_percentage, f'{vote_type} nach Partei (Top 8)')
+    )
     st.plotly_chart(fig)
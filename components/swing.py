@@ -0,0 +1,43 @@
+import streamlit as st
+import pandas as pd
+from utils.swing import get_swing
+from utils.metrics import timed
+from utils.snapshots import get_election_state
+
+
+def select_swing_party():
+    """Map mode selection, returns the party whose swing to show or None for the winners"""
+    swing = get_swing(2, get_election_state().snapshot)
+    mode = st.radio(
+        "Karte",
+        ["Gewinner", "Veränderung zur Vorwahl"],
+        horizontal=True,
+        label_visibility="collapsed",
+        key='map_mode'
+    )
+    if mode == "Gewinner":
+        return None
+    parties = swing.national['current'].dropna().sort_values(ascending=False)
+    return st.selectbox("Partei (Zweitstimmen)", parties.index[parties > 0].tolist(), key='swing_party')
+
+
+@timed()
+def create_swing_summary():
+    """Show the districts that changed hands and the uniform swing projection"""
+    swing = get_swing(1, get_election_state().snapshot)
+    flips = swing.flips
+
+    with st.expander(f"{len(flips)} Wahlkreise mit neuem Gewinner gegenüber der Vorwahl"):
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("Gewinnerwechsel (Erststimmen)")
+            transitions = flips.value_counts().rename('Wahlkreise').reset_index()
+            st.dataframe(transitions.rename(columns={'previous': 'Vorwahl', 'current': 'Jetzt'}),
+                         hide_index=True, use_container_width=True)
+        with col2:
+            st.write("Direktmandate bei einheitlichem Swing")
+            projection = pd.DataFrame({
+                'Gewonnen': swing.winners['label'].value_counts(),
+                'Projektion': swing.projected_winners['label'].value_counts(),
+            }).fillna(0).astype(int).sort_values('Projektion', ascending=False)
+            st.dataframe(projection, use_container_width=True)
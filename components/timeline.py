@@ -0,0 +1,60 @@
+import streamlit as st
+from components.overview import color_map
+from utils.figure_cache import cached_figure
+from utils.history import get_timeline
+from utils.metrics import timed
+from utils.snapshots import get_election_state
+
+# Parties below this share of the second votes in the newest snapshot are
+# left out of the share chart
+MIN_SHARE = 1.0
+
+
+def _line(frame, y_title, title):
+    import plotly.express as px
+
+    fig = px.line(
+        frame.reset_index().melt(id_vars='Stand', var_name='Partei', value_name=y_title),
+        x='Stand', y=y_title, color='Partei', color_discrete_map=color_map, markers=True, title=title
+    )
+    fig.update_layout(xaxis_title='Stand', legend_title_text='')
+    return fig
+
+
+def create_shares_figure(timeline):
+    shares = timeline.shares.loc[:, timeline.shares.iloc[-1] >= MIN_SHARE]
+    return _line(shares.set_index(timeline.progress['Stand']), 'Prozent', 'Zweitstimmenanteil')
+
+
+def create_seats_timeline_figure(timeline):
+    seats = timeline.seats.loc[:, timeline.seats.max() > 0]
+    return _line(seats.set_index(timeline.progress['Stand']), 'Sitze', 'Projizierte Sitzverteilung')
+
+
+def create_progress_figure(timeline):
+    import plotly.express as px
+
+    fig = px.line(timeline.progress, x='Stand', y='Gezählt', markers=True, title='Ausgezählte Wahlkreise')
+    fig.update_layout(yaxis_title='Wahlkreise', yaxis_range=[0, 310])
+    return fig
+
+
+@timed()
+def create_timeline():
+    """Show the counting progress, the national shares and the seats at every snapshot"""
+    state = get_election_state()
+    key = state.key
+    # The snapshot the rest of the page shows, not a newer file the state
+    # is still being built for
+    timeline = get_timeline(state.snapshot, state.version)
+    if len(timeline.progress) < 2:
+        st.info("Der Verlauf wird angezeigt, sobald mehrere Stände vorliegen.")
+        return
+
+    tab1, tab2, tab3 = st.tabs(["Auszählung", "Zweitstimmen", "Sitze"])
+    with tab1:
+        st.plotly_chart(cached_figure((key, 'timeline', 'progress'), lambda: create_progress_figure(timeline)))
+    with tab2:
+        st.plotly_chart(cached_figure((key, 'timeline', 'shares'), lambda: create_shares_figure(timeline)))
+    with tab3:
+        st.plotly_chart(cached_figure((key, 'timeline', 'seats'), lambda: create_seats_timeline_figure(timeline)))
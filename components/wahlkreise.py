@@ -0,0 +1,38 @@
+import streamlit as st
+from components.map import create_wahlkreis_map, selected_wahlkreis
+from components.results import display_wahlkreis_info
+from components.swing import select_swing_party
+from utils.data_loader import geojson_size
+from utils.figure_cache import cached_figure
+from utils.metrics import timed
+from utils.snapshots import get_election_state
+
+
+@st.fragment
+@timed()
+def create_wahlkreis_section(df, geojson_data, map_level):
+    """Map and results of the clicked Wahlkreis.
+
+    A fragment: a click in the map or another map mode only reruns this
+    section, not the rest of the page.
+    """
+    col1, col2 = st.columns(2)
+
+    # Create and display map
+    with col1:
+        state = get_election_state()
+        swing_party = select_swing_party()
+        key = (state.key, 'map', map_level) if swing_party is None else (state.key, 'swing', swing_party, map_level)
+        fig = cached_figure(key, lambda: create_wahlkreis_map(df, geojson_data, geojson_size(map_level), state,
+                                                              swing_party)[0])
+        event = st.plotly_chart(fig, on_select="rerun", selection_mode="points", key="wahlkreis_map")
+
+    # Display results
+    with col2:
+        show_wahlkreis_info(selected_wahlkreis(event))
+
+
+@st.fragment
+def show_wahlkreis_info(selected_wkr_nr):
+    """display_wahlkreis_info as a fragment, its toggles only rerun the results"""
+    display_wahlkreis_info(selected_wkr_nr)
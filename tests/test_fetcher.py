@@ -0,0 +1,114 @@
+# SnapshotFetcher against the local results server (utils/results_server.py)
+#
+#     pytest
+
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import pytest
+
+from utils.fetcher import PUBLISHED, InvalidSnapshot, SnapshotFetcher
+from utils.results_server import ResultsServer
+from utils.store import snapshot_files, store_path
+
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _serve(files):
+    # On a free port
+    server = ResultsServer(files, address=('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def server():
+    # The first two bundled snapshots
+    yield from _serve(snapshot_files()[:2])
+
+
+@pytest.fixture
+def broken_server(tmp_path):
+    # The first bundled snapshot, then the second one cut in half and in
+    # cp1252 instead of UTF-8
+    with open(snapshot_files()[1], 'rb') as f:
+        body = f.read()
+    broken = tmp_path / 'broken.csv'
+    broken.write_bytes(body.decode('utf-8-sig').encode('cp1252', errors='replace')[:len(body) // 2])
+    yield from _serve([snapshot_files()[0], broken])
+
+
+@pytest.fixture
+def results_dir(tmp_path):
+    # Already holds the snapshot the servers start with
+    results_dir = tmp_path / 'results'
+    results_dir.mkdir()
+    shutil.copy(snapshot_files()[0], results_dir / 'kerg2_00001.csv')
+    return str(results_dir)
+
+
+def test_fetcher(server, results_dir):
+    fetcher = SnapshotFetcher(server.url, results_dir)
+    before = sorted(os.listdir(results_dir))
+
+    # The file the directory already has is recognised by its hash
+    assert asyncio.run(fetcher.poll()) is None
+    assert fetcher.etag == server.etag
+    assert sorted(os.listdir(results_dir)) == before
+
+    # With the ETag the server answers 304 and nothing is written
+    assert fetcher._download() is None
+    assert asyncio.run(fetcher.poll()) is None
+    assert sorted(os.listdir(results_dir)) == before
+
+    # A new file is published under the next number, complete and without
+    # temporary files left behind
+    assert server.advance()
+    published = []
+    fetcher.on_publish = published.append
+    path = asyncio.run(fetcher.poll())
+    assert path == os.path.join(results_dir, 'kerg2_00002.csv')
+    assert published == [path]
+    assert _sha256(path) == _sha256(server.files[1])
+    assert os.path.exists(store_path(path))
+    assert not [name for name in os.listdir(results_dir) if name.endswith('.tmp')]
+
+    with open(os.path.join(results_dir, PUBLISHED), encoding='utf-8') as f:
+        record = json.load(f)
+    assert record['snapshot'] == 'kerg2_00002.csv'
+    assert record['sha256'] == _sha256(server.files[1])
+
+
+def test_fetcher_broken_download(broken_server, results_dir):
+    fetcher = SnapshotFetcher(broken_server.url, results_dir, interval=0.1)
+    assert asyncio.run(fetcher.poll()) is None
+    before = sorted(os.listdir(results_dir))
+
+    # A download that is not UTF-8 is rejected like any broken file and
+    # fetched again on the next poll
+    assert broken_server.advance()
+    with pytest.raises(InvalidSnapshot):
+        asyncio.run(fetcher.poll())
+    assert fetcher.etag is None
+    assert sorted(os.listdir(results_dir)) == before
+
+    # and the polling loop keeps running
+    async def run_briefly():
+        stop = asyncio.Event()
+        task = asyncio.create_task(fetcher.run(stop))
+        await asyncio.sleep(0.5)
+        stop.set()
+        await task
+    asyncio.run(run_briefly())
+    assert broken_server.requests >= 4
+    assert sorted(os.listdir(results_dir)) == before
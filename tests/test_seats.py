@@ -0,0 +1,72 @@
+# Seat allocation (utils/seats.py)
+#
+#     pytest
+
+import numpy as np
+import pandas as pd
+
+from utils.seats import (allocate_seats, calculate_seat_distribution, calculate_seats, sainte_lague,
+                         sainte_lague_batch)
+
+
+def test_sainte_lague_totals():
+    result = sainte_lague([412, 298, 151, 87, 52], 20)
+    assert sum(result.seats) == 20
+    assert result.seats == [8, 6, 3, 2, 1]
+    assert result.ties == []
+    # Every party's seats are its votes over the divisor, rounded
+    assert [round(v / result.divisor) for v in [412, 298, 151, 87, 52]] == result.seats
+
+
+def test_sainte_lague_zero_votes():
+    assert sainte_lague([100, 0, 50], 3).seats == [2, 0, 1]
+    result = sainte_lague([0, 0], 3)
+    assert result.seats == [0, 0]
+    assert result.divisor is None
+    assert sainte_lague([3, 1], 0).seats == [0, 0]
+
+
+def test_allocate_seats_ties():
+    df = pd.DataFrame({'Gruppenname': ['A', 'B', 'C'], 'Anzahl': [100, 100, 0]})
+    seats = allocate_seats(df, 1)
+    # The party listed first gets the seat decided by lot
+    assert seats['Sitze'].tolist() == [1, 0, 0]
+    assert seats.attrs['ties'] == ['A', 'B']
+    assert seats.attrs['divisor'] == 200
+
+    seats = allocate_seats(df, 2)
+    assert seats['Sitze'].tolist() == [1, 1, 0]
+    assert seats.attrs['ties'] == []
+
+
+def test_batch_matches_exact():
+    rng = np.random.default_rng(0)
+    votes = rng.integers(0, 1_000_000, size=(500, 7))
+    # Some parties without votes and some exact ties
+    votes[rng.random(votes.shape) < 0.1] = 0
+    votes[::10, 1] = votes[::10, 0]
+    total_seats = rng.integers(0, 700, size=500)
+
+    batch = sainte_lague_batch(votes, total_seats)
+    exact = [sainte_lague(v, s).seats for v, s in zip(votes, total_seats)]
+    np.testing.assert_array_equal(batch, exact)
+
+
+def test_calculate_seats_final():
+    seats = calculate_seats().set_index('Gruppenname')['Sitze']
+    assert seats.to_dict() == {
+        'AfD': 152, 'SPD': 120, 'GRÜNE': 85, 'Die Linke': 64, 'SSW': 1, 'CDU/CSU': 208,
+    }
+
+
+def test_distribute_seats_final():
+    distribution = calculate_seat_distribution()
+    seats = distribution.seats.sum(axis=1)
+    assert seats.sum() == 630
+    assert seats['CDU'] == 164
+    assert seats['CSU'] == 44
+    assert seats['SSW'] == 1
+
+    uncovered = distribution.uncovered
+    assert len(uncovered) == 23
+    assert uncovered['Gruppenname'].value_counts().to_dict() == {'CDU': 15, 'AfD': 4, 'CSU': 3, 'SPD': 1}
@@ -0,0 +1,37 @@
+# Seat simulation (utils/simulation.py) on an early snapshot
+#
+#     pytest
+
+import numpy as np
+
+from utils.data_loader import get_second_votes, get_vote_matrix
+from utils.simulation import _expected_votes, land_presence, simulate_seats
+from utils.store import snapshot_files
+
+BAVARIA = 9
+
+
+def _early_snapshot():
+    # Several Länder have no counted district yet
+    return snapshot_files()[0]
+
+
+def test_fallback_votes_only_where_on_ballot():
+    snapshot = _early_snapshot()
+    matrix = get_vote_matrix(2, snapshot)
+    present = land_presence(matrix, get_second_votes(snapshot))
+    expected, _ = _expected_votes(matrix, present)
+
+    lands = np.asarray(matrix.lands)
+    parties = list(matrix.parties)
+    csu, cdu = parties.index('CSU'), parties.index('CDU')
+    assert expected[lands != BAVARIA, csu].sum() == 0
+    assert expected[lands == BAVARIA, cdu].sum() == 0
+
+
+def test_csu_seats_from_bavaria():
+    result = simulate_seats(n_draws=500, seed=0, workers=1, snapshot=_early_snapshot())
+    # 47 districts at most and a Bavarian second vote share far below the
+    # national CDU/CSU share
+    assert result.loc['CSU', 'Q95'] < 60
+    assert 'SSW' not in result.index or result.loc['SSW', 'Mittel'] > 0
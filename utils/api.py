@@ -0,0 +1,228 @@
+# JSON API over the precomputed results
+#
+# A small HTTP service for partner newsrooms, separate from the Streamlit
+# app. Every response of a snapshot is rendered once when the snapshot
+# arrives: the JSON body, a gzip copy and a strong ETag derived from the
+# snapshot id. Answering a request is a dict lookup and a socket write,
+# pandas is not touched.
+#
+#     python -m utils.api --port 8700
+#
+#     /api/snapshot           id, sequence number and time of the snapshot
+#     /api/totals             national first and second votes per party
+#     /api/seats              seats per party, see seats.calculate_seats
+#     /api/winners            winner of every Wahlkreis
+#     /api/wahlkreise         number, name and winner of every Wahlkreis
+#     /api/wahlkreis/<nr>     results of one Wahlkreis
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+
+import pandas as pd
+
+from utils.district_index import get_district_index
+from utils.rollup import get_rollup
+from utils.snapshots import get_election_state
+from utils.static_site import district_data
+from utils.store import snapshot_time
+
+PORT = 8700
+# Seconds between the checks for a new snapshot
+REFRESH_INTERVAL = 5
+# Clients and CDNs may reuse a response this long without revalidating
+MAX_AGE = 15
+
+logger = logging.getLogger(__name__)
+
+
+class Response(NamedTuple):
+    body: bytes
+    # gzip copy of body, None where compressing does not pay off
+    gzipped: bytes
+    etag: str
+
+
+def _response(data, etag):
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+    return Response(body, gzipped if len(gzipped) < len(body) else None, etag)
+
+
+def render_responses(state):
+    """Path -> Response for every resource of an election state"""
+    snapshot = os.path.basename(state.snapshot)
+    # Strong ETag of the snapshot id, all responses of a snapshot change
+    # together when the next one arrives
+    etag = f'{state.version.number}-{state.version.sha256[:16]}'
+    rollup = get_rollup(state.snapshot)
+    index = get_district_index(state.snapshot)
+    stand = snapshot_time(state.snapshot)
+
+    documents = {
+        '/api/snapshot': {
+            'snapshot': snapshot,
+            'number': state.version.number,
+            'sha256': state.version.sha256,
+            'time': None if pd.isna(stand) else stand.isoformat(),
+        },
+        '/api/totals': {
+            'snapshot': snapshot,
+            'first_votes': {party: int(n) for party, n in rollup.national(1).items()},
+            'second_votes': {party: int(n) for party, n in rollup.national(2).items()},
+        },
+        '/api/seats': {
+            'snapshot': snapshot,
+            'seats': dict(zip(state.seats['Gruppenname'], state.seats['Sitze'].astype(int).tolist())),
+        },
+        '/api/winners': {
+            'snapshot': snapshot,
+            'winners': {str(nr): label for nr, label in state.district_winners['label'].items()},
+        },
+    }
+    districts = []
+    for nr, result in index.items():
+        documents[f'/api/wahlkreis/{nr}'] = {'snapshot': snapshot, **district_data(nr, result)}
+        districts.append({'WKR_NR': nr, 'name': result.name, 'winner': result.winner})
+    documents['/api/wahlkreise'] = {'snapshot': snapshot, 'wahlkreise': districts}
+
+    return {path: _response(data, etag) for path, data in documents.items()}
+
+
+def _accepts_gzip(accept_encoding):
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+
+class ApiServer(ThreadingHTTPServer):
+    """Serves the responses of the newest election state, re-rendered when it changes"""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', PORT), interval=REFRESH_INTERVAL):
+        super().__init__(address, ApiHandler)
+        self.interval = interval
+        self.version = None
+        self.responses = {}
+        self._stop = threading.Event()
+        self.refresh()
+
+    def refresh(self):
+        """Render the newest election state if it changed, returns whether it did"""
+        state = get_election_state()
+        if state.version == self.version:
+            return False
+        # Swapped in one assignment, requests see the old or the new snapshot
+        self.responses = render_responses(state)
+        self.version = state.version
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the previous snapshot
+                logger.exception("refresh failed")
+
+    def serve_forever(self, poll_interval=0.5):
+        watcher = threading.Thread(target=self._watch, name='api-refresh', daemon=True)
+        watcher.start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._stop.set()
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients can send many requests over one connection
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in two writes, without this the body waits
+    # for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body):
+        response = self.server.responses.get(self.path.split('?', 1)[0].rstrip('/'))
+        if response is None:
+            self._send_json(404, b'{"error":"not found"}', send_body)
+            return
+
+        gzipped = response.gzipped is not None and _accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        # Both representations need their own strong ETag
+        etag = f'"{response.etag}-gz"' if gzipped else f'"{response.etag}"'
+        if self._not_modified(etag):
+            self.send_response(304)
+            self._common_headers(etag, response)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = response.gzipped if gzipped else response.body
+        self.send_response(200)
+        self._common_headers(etag, response)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _common_headers(self, etag, response):
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', f'public, max-age={MAX_AGE}')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if response.gzipped is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def _not_modified(self, etag):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is None:
+            return False
+        # If-None-Match uses the weak comparison
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+
+    def _send_json(self, code, body, send_body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the election results as JSON")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL, help="seconds between snapshot checks")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from streamlit.logger import set_log_level
+    set_log_level('error')
+    server = ApiServer((args.host, args.port), args.interval)
+    print(f"serving {os.path.basename(get_election_state().snapshot)} at {server.url}/api/", flush=True)
+    server.serve_forever()
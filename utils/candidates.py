@@ -0,0 +1,112 @@
+# Candidate dimension of the Wahlkreis results
+#
+# The Bewerber file has 35 columns and also lists the Landeslisten, the app
+# only needs the district candidates' names. They are ingested once into
+# results/store/ as one row per (Gebietsnummer, Gruppenname) with the
+# display label precomputed, strings dictionary encoded. Result rows are
+# matched to it through integer codes (district number and party code), not
+# by merging on strings.
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from utils.store import store_path
+
+CANDIDATES = 'results/btw25_bewerb_utf8.csv'
+
+# Columns read from the Bewerber file
+COLUMNS = ['Kennzeichen', 'Gebietsnummer', 'Gebietsname', 'GruppennameKurz', 'Rufname', 'Nachname']
+
+SCHEMA = pa.schema([
+    ('Gebietsnummer', pa.int16()),
+    ('Gebietsname', pa.dictionary(pa.int16(), pa.string())),
+    # GruppennameKurz, "EB:Nachname" for Einzelbewerber like in the results
+    ('Gruppenname', pa.dictionary(pa.int16(), pa.string())),
+    ('Name', pa.string()),
+    # "Rufname Nachname (Gruppenname)"
+    ('label', pa.dictionary(pa.int16(), pa.string())),
+])
+
+
+def parse_candidates(csv_path=CANDIDATES):
+    """Read the district candidates of the Bewerber file as an Arrow table with SCHEMA"""
+    candidates = pd.read_csv(csv_path, delimiter=';', encoding='utf-8', skiprows=8, usecols=COLUMNS,
+                             dtype={'Kennzeichen': 'category', 'Gebietsname': 'category'})
+    candidates = candidates[candidates['Kennzeichen'].isin(['Kreiswahlvorschlag', 'anderer Kreiswahlvorschlag'])]
+    # Einzelbewerber have no GruppennameKurz, the results call them "EB:Nachname"
+    gruppenname = candidates['GruppennameKurz'].fillna('EB:' + candidates['Nachname'])
+    name = candidates['Rufname'] + ' ' + candidates['Nachname']
+    dimension = pd.DataFrame({
+        'Gebietsnummer': candidates['Gebietsnummer'],
+        'Gebietsname': candidates['Gebietsname'],
+        'Gruppenname': gruppenname,
+        'Name': name,
+        'label': name + ' (' + gruppenname + ')',
+    }).drop_duplicates(['Gebietsnummer', 'Gruppenname'])
+    return pa.Table.from_pandas(dimension, preserve_index=False).cast(SCHEMA)
+
+
+def ingest_candidates(csv_path=CANDIDATES, force=False):
+    """Write the candidate dimension into the store unless an up-to-date copy exists"""
+    path = store_path(csv_path)
+    if not force and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = parse_candidates(csv_path)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_candidates(csv_path=CANDIDATES):
+    """Candidate dimension, one row per (Gebietsnummer, Gruppenname), strings as categoricals"""
+    table = ipc.open_file(pa.memory_map(ingest_candidates(csv_path))).read_all()
+    return table.to_pandas()
+
+
+def candidate_rows(candidates, gebietsnummer, gruppenname):
+    """Row of the candidate dimension for every (Gebietsnummer, Gruppenname) pair, -1 where there is none.
+
+    Builds a (district x party code) table of row numbers, so the lookup
+    is one array index instead of a merge.
+    """
+    parties = candidates['Gruppenname'].cat.categories
+    nr = np.asarray(gebietsnummer, dtype=np.int64)
+    codes = pd.Categorical(gruppenname, categories=parties).codes
+
+    candidate_nr = candidates['Gebietsnummer'].to_numpy(dtype=np.int64)
+    n_districts = max(candidate_nr.max(initial=0), nr.max(initial=0)) + 1
+    table = np.full((n_districts, len(parties)), -1, dtype=np.int32)
+    table[candidate_nr, candidates['Gruppenname'].cat.codes.to_numpy()] = np.arange(len(candidates))
+
+    rows = np.full(len(nr), -1, dtype=np.int32)
+    known = (codes >= 0) & (nr >= 0)
+    rows[known] = table[nr[known], codes[known]]
+    return rows
+
+
+def attach_candidates(votes, candidates, columns=('label',)):
+    """votes with the given columns of the candidate dimension, NaN where there is no candidate"""
+    rows = candidate_rows(candidates, votes['Gebietsnummer'], votes['Gruppenname'])
+    missing = rows < 0
+    attached = {}
+    for column in columns:
+        values = candidates[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes = np.where(missing, -1, values.cat.codes.to_numpy()[rows])
+            attached[column] = pd.Categorical.from_codes(codes, dtype=values.dtype)
+        else:
+            attached[column] = np.where(missing, None, values.to_numpy()[rows])
+    return votes.assign(**attached)
+
+
+if __name__ == "__main__":
+    print(ingest_candidates(force=True))
@@ -1,51 +1,121 @@
-import geopandas as gpd
+import os
+
 import pandas as pd
-import json
 import streamlit as st
-import glob
-import os
+from utils.candidates import CANDIDATES, attach_candidates, read_candidates
+from utils.geometry import read_geometry
+from utils.matrix import build_vote_matrix, find_winners
+from utils.metrics import cache_miss, timed
+from utils.shared_store import shared_frame
+from utils.store import RETAINED_SNAPSHOTS, newest_snapshot, read_only, read_snapshot, snapshot_version
+
+
+@st.cache_resource
+@cache_miss('load_geojson')
+def load_geometry(level='full'):
+    """Load the prebuilt district geometry, shared by all sessions (do not modify)"""
+    return read_geometry(level)
 
+@timed()
+def load_geojson(level='full'):
+    """Load the district GeoJSON (shared, do not modify), see geometry.LEVELS"""
+    return load_geometry(level).geojson
 
-@st.cache_data
-def load_geojson():
-    """Load and process the shapefile data"""
-    return gpd.read_file("shapefiles/btw25_geometrie_wahlkreise_shp_geo.shp").to_json()
+def geojson_size(level='full'):
+    """Length of the district GeoJSON of a level as compact JSON"""
+    return load_geometry(level).size
 
-def process_geojson(geojson_str):
-    """Convert GeoJSON string to DataFrame with required columns"""
-    geojson_data = json.loads(geojson_str)
+@timed()
+def process_geojson(geojson_data):
+    """Convert GeoJSON to DataFrame with required columns"""
     return pd.DataFrame([{
         'WKR_NR': f['properties']['WKR_NR'],
         'WKR_NAME': f['properties']['WKR_NAME']
     } for f in geojson_data['features']]) 
 
-@st.cache_data
-def load_election_results():
-    """Load and process election results data"""
+@timed()
+def load_election_results(snapshot=None):
+    """Load and process election results data (shared, do not modify)"""
+    snapshot = snapshot or newest_snapshot()
+    return _load_election_results(snapshot, snapshot_version(snapshot))
 
-    kerg2_files = glob.glob('results/kerg2_*.csv')
-    newest_file = max(kerg2_files, key=lambda x: int(os.path.basename(x).split('_')[1].split('.')[0]))
-    
-    # Load raw results, skipping header rows
-    results = pd.read_csv(newest_file, delimiter=';', skiprows=9)
-    
-    # Filter for Wahlkreis level results
-    results = results[results.Gebietsart == 'Wahlkreis']
-    
-    return results
-
-@st.cache_data 
-def get_first_votes():
-    """Get first votes (Erststimmen) results by party"""
-    results = load_election_results()
-    return results[(results.Stimme == 1) & (results.Gruppenart.isin(['Partei', 'Einzelbewerber/Wählergruppe' ]))]
-
-@st.cache_data
-def get_second_votes():
-    """Get second votes (Zweitstimmen) results by party"""
-    results = load_election_results()
-    return results[(results.Stimme == 2) & (results.Gruppenart=='Partei')]
-    
-@st.cache_data
+@timed()
+def get_first_votes(snapshot=None):
+    """Get first votes (Erststimmen) results by party, with the candidate's label (shared, do not modify)"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_first_votes(snapshot, snapshot_version(snapshot))
+
+@timed()
+def get_second_votes(snapshot=None):
+    """Get second votes (Zweitstimmen) results by party (shared, do not modify)"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_second_votes(snapshot, snapshot_version(snapshot))
+
+@timed()
+def get_vote_matrix(stimme, snapshot=None):
+    """Get the district x party VoteMatrix of the first (1) or second (2) votes (shared, do not modify)"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_vote_matrix(stimme, snapshot, snapshot_version(snapshot))
+
+@timed()
+def get_district_winners(snapshot=None):
+    """Get the winner of each district (shared, do not modify), see matrix.find_winners"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_district_winners(snapshot, snapshot_version(snapshot))
+
+@timed()
 def load_candidates():
-    return pd.read_csv('results/btw25_bewerb_utf8.csv', delimiter=';', encoding='utf-8', skiprows=8)
+    """Load the Wahlkreis candidates (shared, do not modify), see candidates.read_candidates"""
+    return _load_candidates(CANDIDATES, os.stat(CANDIDATES).st_mtime_ns)
+
+# The cached loaders are keyed on the snapshot file and its version (see
+# store.snapshot_version), so a new or rewritten kerg2 file is picked up on
+# the next call. Only the newest RETAINED_SNAPSHOTS are kept.
+#
+# They are resources: every caller gets the same frame instead of an
+# unpickled copy, so their data is read-only (see store.read_only) and
+# writing into them raises. With a shared store the frames of the current
+# generation are memory mapped read-only instead, see utils/shared_store.py.
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+@cache_miss('load_election_results')
+def _load_election_results(snapshot, version):
+    # Wahlkreis level results, read from the columnar store
+    return read_only(read_snapshot(snapshot, gebietsart='Wahlkreis'))
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+@cache_miss('get_first_votes')
+def _get_first_votes(snapshot, version):
+    shared = shared_frame('first_votes', snapshot, version)
+    if shared is not None:
+        return shared
+    votes = read_snapshot(snapshot, gebietsart='Wahlkreis', stimme=1,
+                          gruppenart=['Partei', 'Einzelbewerber/Wählergruppe'])
+    return read_only(attach_candidates(votes, load_candidates()))
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+@cache_miss('get_second_votes')
+def _get_second_votes(snapshot, version):
+    shared = shared_frame('second_votes', snapshot, version)
+    if shared is not None:
+        return shared
+    return read_only(read_snapshot(snapshot, gebietsart='Wahlkreis', stimme=2, gruppenart=['Partei']))
+
+@st.cache_resource(max_entries=2 * RETAINED_SNAPSHOTS)
+@cache_miss('get_vote_matrix')
+def _get_vote_matrix(stimme, snapshot, version):
+    votes = _get_first_votes(snapshot, version) if stimme == 1 else _get_second_votes(snapshot, version)
+    return build_vote_matrix(votes)
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+@cache_miss('get_district_winners')
+def _get_district_winners(snapshot, version):
+    shared = shared_frame('district_winners', snapshot, version)
+    if shared is not None:
+        return shared
+    return read_only(find_winners(_get_vote_matrix(1, snapshot, version)))
+    
+@st.cache_resource(max_entries=1)
+@cache_miss('load_candidates')
+def _load_candidates(path, mtime):
+    return read_only(read_candidates(path))
@@ -0,0 +1,120 @@
+# Results per Wahlkreis for the click-to-details path
+#
+# The first and second votes are split by district once per snapshot and
+# sorted, with the candidate labels attached by the loader, so showing the details of
+# a clicked district is a dict lookup instead of filtering, merging and
+# sorting the full frames on every click.
+
+from collections.abc import Mapping
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.data_loader import get_district_winners, get_first_votes, get_second_votes
+from utils.metrics import cache_miss, timed
+from utils.shared_store import shared_frame
+from utils.store import RETAINED_SNAPSHOTS, newest_snapshot, read_only, snapshot_version
+
+
+class DistrictResult(NamedTuple):
+    # Gebietsname of the Wahlkreis
+    name: str
+    # Label of the winner, see matrix.find_winners
+    winner: str
+    # First votes sorted by Anzahl, with a label "Rufname Nachname (Partei)"
+    first_votes: pd.DataFrame
+    # Second votes sorted by Anzahl
+    second_votes: pd.DataFrame
+
+
+def _sort(votes):
+    # Sorted by district and votes, with the row range of every district
+    votes = read_only(votes.sort_values(['Gebietsnummer', 'Anzahl'], ascending=[True, False], kind='stable',
+                                        ignore_index=True))
+    return votes, _district_rows(votes)
+
+
+def _district_rows(votes):
+    districts = votes['Gebietsnummer'].to_numpy()
+    starts = np.flatnonzero(np.append(True, districts[1:] != districts[:-1]))
+    ends = np.append(starts[1:], len(districts))
+    return dict(zip(districts[starts].tolist(), zip(starts.tolist(), ends.tolist())))
+
+
+class DistrictIndex(Mapping):
+    """DistrictResult of every Wahlkreis, keyed by WKR_NR.
+
+    The votes are kept as one sorted frame per Stimme with the row range of
+    every district, a lookup slices them. Building a frame per district up
+    front takes seconds with tens of thousands of districts.
+    """
+
+    def __init__(self, first_votes, second_votes, names, winners, presorted=False):
+        if presorted:
+            # Frames of another DistrictIndex, e.g. memory mapped from a shared store
+            self._first, self._first_rows = first_votes, _district_rows(first_votes)
+            self._second, self._second_rows = second_votes, _district_rows(second_votes)
+        else:
+            self._first, self._first_rows = _sort(first_votes)
+            self._second, self._second_rows = _sort(second_votes)
+        self._names = names
+        self._winners = winners
+
+    def __getitem__(self, nr):
+        a, b = self._first_rows[nr]
+        c, d = self._second_rows.get(nr, (0, 0))
+        return DistrictResult(
+            name=self._names[nr],
+            winner=self._winners.get(nr, 'Keine Ergebnisse'),
+            first_votes=self._first.iloc[a:b],
+            second_votes=self._second.iloc[c:d],
+        )
+
+    def __iter__(self):
+        return iter(self._first_rows)
+
+    def __len__(self):
+        return len(self._first_rows)
+
+    @property
+    def sorted_votes(self):
+        """First and second votes sorted by Gebietsnummer and Anzahl, as the index keeps them (shared, do not modify)"""
+        return self._first, self._second
+
+
+def build_district_index(first_votes, second_votes, district_winners, presorted=False):
+    """Build the DistrictIndex of a snapshot from the labelled first votes.
+
+    With presorted, the votes are the frames of another DistrictIndex,
+    already sorted and with every party labelled.
+    """
+    if not presorted:
+        # Parties without a known candidate are labelled with their name
+        label = first_votes['label'].astype(object).to_numpy()
+        first_votes = first_votes.assign(label=np.where(pd.isna(label), first_votes['Gruppenname'], label))
+
+    names = first_votes.drop_duplicates('Gebietsnummer').set_index('Gebietsnummer')['Gebietsname']
+    return DistrictIndex(
+        first_votes, second_votes,
+        names={int(nr): name for nr, name in names.items()},
+        winners={int(nr): label for nr, label in district_winners['label'].items()},
+        presorted=presorted,
+    )
+
+
+@timed()
+def get_district_index(snapshot=None):
+    """Results per Wahlkreis of a snapshot (shared, do not modify), see build_district_index"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_district_index(snapshot, snapshot_version(snapshot))
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+@cache_miss('get_district_index')
+def _get_district_index(snapshot, version):
+    shared = shared_frame('district_first', snapshot, version)
+    if shared is not None:
+        return build_district_index(shared, shared_frame('district_second', snapshot, version),
+                                    get_district_winners(snapshot), presorted=True)
+    return build_district_index(get_first_votes(snapshot), get_second_votes(snapshot), get_district_winners(snapshot))
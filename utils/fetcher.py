@@ -0,0 +1,200 @@
+# Background fetcher for new kerg2 snapshots
+#
+# Polls the results URL with conditional requests (ETag / If-Modified-Since),
+# so an unchanged file costs one 304 response. A new file is streamed to a
+# temporary file next to the snapshots, validated, and published with an
+# atomic rename under the next sequence number. The published snapshot and
+# its hash are recorded in PUBLISHED; running app processes notice the new
+# file within seconds and rerun (see components/live.py).
+#
+#     python -m utils.fetcher --url https://.../kerg2.csv --interval 30
+#
+# utils/results_server.py serves the bundled snapshots for testing.
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from utils.store import (RESULTS_DIR, SCHEMA, ingest_snapshot, parse_snapshot, snapshot_files, snapshot_number,
+                         snapshot_version)
+
+RESULTS_URL = os.environ.get('KERG2_URL')
+POLL_INTERVAL = 30
+TIMEOUT = 60
+CHUNK_SIZE = 1 << 16
+
+PUBLISHED = 'published.json'
+
+# The kerg2 header is on line 10, after the preamble
+HEADER_LINE = 10
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidSnapshot(ValueError):
+    pass
+
+
+def validate_snapshot(path, previous=None):
+    """Check the header and rows of a downloaded kerg2 file, raises InvalidSnapshot.
+
+    A later snapshot never has fewer rows than the one before it, rows are
+    only added as Einzelbewerber and small parties report.
+    """
+    try:
+        with open(path, encoding='utf-8-sig') as f:
+            lines = [f.readline() for _ in range(HEADER_LINE)]
+    except UnicodeDecodeError as e:
+        # Truncated within a character, or not UTF-8 at all
+        raise InvalidSnapshot(str(e)) from e
+    columns = lines[-1].rstrip('\r\n').split(';')
+    missing = [c for c in SCHEMA.names if c not in columns]
+    if missing:
+        raise InvalidSnapshot(f"header is missing {', '.join(missing)}")
+
+    try:
+        table = parse_snapshot(path)
+    except ValueError as e:
+        raise InvalidSnapshot(str(e)) from e
+    gebietsarten = set(table['Gebietsart'].unique().cast(pa.string()).to_pylist())
+    if not {'Bund', 'Land', 'Wahlkreis'} <= gebietsarten:
+        raise InvalidSnapshot(f"expected Bund, Land and Wahlkreis rows, got {sorted(gebietsarten)}")
+    if previous is not None:
+        rows = ipc.open_file(pa.memory_map(ingest_snapshot(previous))).read_all().num_rows
+        if table.num_rows < rows:
+            raise InvalidSnapshot(f"{table.num_rows} rows, the previous snapshot has {rows}")
+    return table.num_rows
+
+
+def publish_snapshot(tmp_path, results_dir=RESULTS_DIR):
+    """Move a validated download into results_dir under the next sequence number"""
+    files = snapshot_files(results_dir)
+    number = snapshot_number(files[-1]) + 1 if files else 1
+    path = os.path.join(results_dir, f'kerg2_{number:05d}.csv')
+    os.replace(tmp_path, path)
+    ingest_snapshot(path)
+    return path
+
+
+def notify_published(path, sha256, results_dir=RESULTS_DIR):
+    """Record the newest published snapshot for the running app processes"""
+    target = os.path.join(results_dir, PUBLISHED)
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({
+            'snapshot': os.path.basename(path),
+            'sha256': sha256,
+            'published': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }, f)
+    os.replace(tmp, target)
+
+
+class SnapshotFetcher:
+    """Polls url and publishes every new snapshot into results_dir"""
+
+    def __init__(self, url, results_dir=RESULTS_DIR, interval=POLL_INTERVAL, on_publish=None):
+        self.url = url
+        self.results_dir = results_dir
+        self.interval = interval
+        # Called with the path of every published snapshot
+        self.on_publish = on_publish
+        self.etag = None
+        self.last_modified = None
+        files = snapshot_files(results_dir)
+        # Servers without ETag support send the same file again, it is
+        # recognised by its hash
+        self.last_hash = snapshot_version(files[-1]).sha256 if files else None
+
+    def _download(self):
+        # Blocking part of a poll, runs in a worker thread. Returns the path
+        # of the temporary file and its hash, None if nothing changed
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        request = urllib.request.Request(self.url, headers=headers)
+        try:
+            response = urllib.request.urlopen(request, timeout=TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None
+            raise
+
+        tmp = os.path.join(self.results_dir, f'.kerg2_download.{os.getpid()}.tmp')
+        digest = hashlib.sha256()
+        with response, open(tmp, 'wb') as f:
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        return tmp, digest.hexdigest()
+
+    def _ingest(self, tmp, sha256):
+        # Validate and publish a download, returns the published path or None
+        try:
+            if sha256 == self.last_hash:
+                return None
+            files = snapshot_files(self.results_dir)
+            validate_snapshot(tmp, files[-1] if files else None)
+            path = publish_snapshot(tmp, self.results_dir)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        self.last_hash = sha256
+        notify_published(path, sha256, self.results_dir)
+        return path
+
+    async def poll(self):
+        """Fetch the URL once, returns the path of a newly published snapshot or None"""
+        download = await asyncio.to_thread(self._download)
+        if download is None:
+            return None
+        try:
+            path = await asyncio.to_thread(self._ingest, *download)
+        except InvalidSnapshot:
+            # Download the file again on the next poll
+            self.etag = self.last_modified = None
+            raise
+        if path is not None and self.on_publish is not None:
+            self.on_publish(path)
+        return path
+
+    async def run(self, stop=None):
+        """Poll until stop (an asyncio.Event) is set"""
+        stop = stop or asyncio.Event()
+        while not stop.is_set():
+            start = time.monotonic()
+            try:
+                path = await self.poll()
+                if path:
+                    logger.info("published %s", path)
+            except (OSError, InvalidSnapshot) as e:
+                # Network errors and broken files are retried on the next poll
+                logger.warning("poll of %s failed: %s", self.url, e)
+            try:
+                await asyncio.wait_for(stop.wait(), max(0, self.interval - (time.monotonic() - start)))
+            except asyncio.TimeoutError:
+                pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch new kerg2 snapshots")
+    parser.add_argument('--url', default=RESULTS_URL, required=RESULTS_URL is None,
+                        help="URL of the kerg2 file (default: $KERG2_URL)")
+    parser.add_argument('--results-dir', default=RESULTS_DIR)
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="seconds between polls")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    asyncio.run(SnapshotFetcher(args.url, args.results_dir, args.interval).run())
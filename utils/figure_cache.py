@@ -0,0 +1,164 @@
+# Cache of the Plotly figures of the app
+#
+# Most reruns (a toggle, a click in the map) show figures that did not
+# change since the last run. The figures are stored as Plotly JSON, keyed
+# by (snapshot, version) of the election state they show (ElectionState.key),
+# component and the view options, in a bounded LRU shared by
+# all sessions. When a new snapshot arrives, the figures every visitor sees
+# first are built in a background thread.
+
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+import streamlit as st
+
+# Bounds of the cache, the map of one geometry level is about 0.5 MB
+MAX_ENTRIES = 256
+MAX_BYTES = 64 * 2**20
+
+
+class FigureCache:
+    """LRU of serialized figures, bounded by entries and bytes"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Keys being built right now, so a figure is only built once
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def evict(self, stale):
+        """Drop the figures whose key makes stale(key) true"""
+        with self._lock:
+            for key in [key for key in self._entries if stale(key)]:
+                self.nbytes -= len(self._entries.pop(key))
+
+    def get(self, key):
+        """Figure stored under key, None if there is none"""
+        with self._lock:
+            spec = self._entries.get(key)
+            if spec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return pio.from_json(spec)
+
+    def put(self, key, figure):
+        spec = pio.to_json(figure, validate=False)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key))
+            self._entries[key] = spec
+            self.nbytes += len(spec)
+            # Evict the least recently used figures
+            while len(self._entries) > self.max_entries or (self.nbytes > self.max_bytes and len(self._entries) > 1):
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def get_or_build(self, key, build):
+        """Figure stored under key, calling build() and storing the result on a miss.
+
+        If another thread is building the same key, wait for its result.
+        """
+        figure = self.get(key)
+        if figure is not None:
+            return figure
+
+        with self._lock:
+            done = self._building.get(key)
+            builder = done is None and key not in self._entries
+            if builder:
+                done = self._building[key] = threading.Event()
+        if done is None:
+            # Stored in the meantime
+            figure = self.get(key)
+        elif not builder:
+            done.wait()
+            figure = self.get(key)
+        if figure is not None:
+            return figure
+
+        try:
+            figure = build()
+            self.put(key, figure)
+        finally:
+            if builder:
+                with self._lock:
+                    del self._building[key]
+                done.set()
+        return figure
+
+
+@st.cache_resource
+def get_figure_cache():
+    """Figure cache shared by all sessions of this process"""
+    return FigureCache()
+
+
+def cached_figure(key, build):
+    """Shortcut for get_figure_cache().get_or_build"""
+    return get_figure_cache().get_or_build(key, build)
+
+
+@st.cache_resource
+def _warmed_snapshots():
+    return {'snapshots': set(), 'lock': threading.Lock()}
+
+
+def forget_snapshots(snapshots, versions=()):
+    """Drop the figures of superseded snapshot files and of superseded (snapshot, version) pairs.
+
+    Keys start with the (snapshot, version) of the figure.
+    """
+    if not snapshots and not versions:
+        return
+
+    def stale(state_key):
+        return state_key in versions or state_key[0] in snapshots
+
+    get_figure_cache().evict(lambda key: stale(key[0]))
+    warmed = _warmed_snapshots()
+    with warmed['lock']:
+        warmed['snapshots'] = {state_key for state_key in warmed['snapshots'] if not stale(state_key)}
+
+
+def warm_figures(state_key, builders):
+    """Build the figures of a new snapshot in a background thread.
+
+    builders maps cache keys to functions building the figure. Only the
+    first call per (snapshot, version) starts a thread, keys already
+    cached are skipped.
+    """
+    warmed = _warmed_snapshots()
+    with warmed['lock']:
+        if state_key in warmed['snapshots']:
+            return None
+        warmed['snapshots'].add(state_key)
+
+    cache = get_figure_cache()
+
+    def warm():
+        for key, build in builders.items():
+            if key not in cache:
+                cache.get_or_build(key, build)
+
+    thread = threading.Thread(target=warm, name=f'warm-figures-{state_key[0]}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,332 @@
+# Prebuilt district geometry
+#
+# The shapefile is converted once into a NumPy artifact with flat
+# coordinate and offset arrays (like GeoArrow) plus the attribute table.
+# Loading it needs neither geopandas nor any JSON parsing.
+#
+# Besides the full resolution, the artifact holds simplified levels for the
+# map. Like TopoJSON, the rings are cut into arcs at the points where
+# districts meet, and every arc is simplified once, so neighbouring
+# districts keep a common border. Their coordinates are quantized to a
+# fixed number of decimals, which keeps the JSON sent to the browser short.
+
+import argparse
+import gzip
+import json
+import os
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+
+SHAPEFILE = 'shapefiles/btw25_geometrie_wahlkreise_shp_geo.shp'
+GEOMETRY_PATH = 'shapefiles/btw25_wahlkreise.npz'
+
+ATTRIBUTES = ['WKR_NR', 'WKR_NAME', 'LAND_NR', 'LAND_NAME']
+
+# Simplified levels: Douglas-Peucker tolerance in degrees (latitude) and
+# decimals of the quantized coordinates. medium is about 5x smaller than
+# the full resolution (7x gzipped), not 10x: that needs a tolerance beyond
+# the one of low (about 500 m), coarse against city districts that are a
+# few kilometres across.
+LEVELS = {
+    'high': (0.0005, 5),
+    'medium': (0.002, 4),
+    'low': (0.005, 3),
+}
+# The level coordinates are stored as integers in units of the finest
+# grid, districts that fall back to unsimplified arcs use it (see
+# _simplify_rings)
+COORD_DECIMALS = max(decimals for _, decimals in LEVELS.values())
+# Level used by the map, see python -m utils.geometry --report
+DEFAULT_LEVEL = 'medium'
+
+# Grid used to match identical points of neighbouring districts
+TOPOLOGY_DECIMALS = 6
+
+
+class Geometry(NamedTuple):
+    # GeoJSON FeatureCollection for plotly
+    geojson: dict
+    # Attribute table, one row per district
+    districts: pd.DataFrame
+    # Length of the GeoJSON as compact JSON, measured once when it is read
+    size: int
+
+
+def build_geometry(shapefile=SHAPEFILE, path=GEOMETRY_PATH):
+    """Convert the shapefile into the geometry artifact (needs geopandas)"""
+    try:
+        import geopandas as gpd
+        import shapely
+    except ImportError as e:
+        raise ImportError(f"building {path} needs geopandas, install it with poetry install --with geometry") from e
+
+    gdf = gpd.read_file(shapefile).sort_values('WKR_NR').reset_index(drop=True)
+
+    # Polygons per feature, rings per polygon (exterior first) and
+    # coordinates per ring, stored as offsets into the next level
+    polygons, polygon_feature = shapely.get_parts(gdf.geometry.values, return_index=True)
+    rings, ring_polygon = shapely.get_rings(polygons, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+
+    def offsets(index, n):
+        return np.concatenate([[0], np.cumsum(np.bincount(index, minlength=n))]).astype(np.int32)
+
+    ring_offsets = offsets(coord_ring, len(rings))
+    polygon_offsets = offsets(ring_polygon, len(polygons))
+    feature_offsets = offsets(polygon_feature, len(gdf))
+    arcs, ring_arcs = _arcs(coords, ring_offsets)
+    levels = {}
+    for level, (tolerance, decimals) in LEVELS.items():
+        level_coords, level_offsets = _simplify_rings(arcs, ring_arcs, tolerance, decimals,
+                                                      polygon_offsets, feature_offsets)
+        levels[f'{level}_coords'] = level_coords
+        levels[f'{level}_ring_offsets'] = level_offsets
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez_compressed(
+        path,
+        coords=coords,
+        ring_offsets=ring_offsets,
+        polygon_offsets=polygon_offsets,
+        feature_offsets=feature_offsets,
+        **levels,
+        **{name: gdf[name].to_numpy(dtype=np.int16 if name == 'WKR_NR' else str) for name in ATTRIBUTES}
+    )
+    return path
+
+
+def _arcs(coords, ring_offsets):
+    """Cut the rings into arcs shared by neighbouring rings.
+
+    Returns the arcs as coordinate arrays and for every ring the list of
+    (arc, reversed) it is made of.
+    """
+    # Identify points on a fine grid, so both sides of a border match
+    grid = np.round(coords * 10 ** TOPOLOGY_DECIMALS).astype(np.int64)
+    _, point_ids = np.unique(grid, axis=0, return_inverse=True)
+    point_ids = point_ids.ravel()
+
+    # Rings as point ids without the closing point and without repeats
+    ring_ids = []
+    for r in range(len(ring_offsets) - 1):
+        ids = point_ids[ring_offsets[r]:ring_offsets[r + 1] - 1]
+        ids = ids[np.append(ids[1:] != ids[:-1], ids[-1] != ids[0])]
+        ring_ids.append(ids)
+
+    # A point is a junction if its neighbours differ between the rings
+    # that use it, i.e. where a shared border starts or ends
+    ids = np.concatenate(ring_ids)
+    prev = np.concatenate([np.roll(r, 1) for r in ring_ids])
+    next_ = np.concatenate([np.roll(r, -1) for r in ring_ids])
+    neighbours = np.unique(np.stack([ids, np.minimum(prev, next_), np.maximum(prev, next_)], axis=1), axis=0)
+    junction = np.zeros(len(coords), dtype=bool)
+    pid, count = np.unique(neighbours[:, 0], return_counts=True)
+    junction[pid[count > 1]] = True
+
+    point_coords = np.zeros((point_ids.max() + 1, 2))
+    point_coords[point_ids] = coords
+
+    arcs, arc_index, ring_arcs = [], {}, []
+    for ids in ring_ids:
+        cuts = np.flatnonzero(junction[ids])
+        if len(cuts) == 0:
+            # Closed ring without neighbours (or shared as a whole, like an
+            # enclave): start at the smallest id in a fixed direction
+            ids = np.roll(ids, -ids.argmin())
+            if ids[-1] < ids[1]:
+                ids = np.roll(ids[::-1], 1)
+            pieces = [np.append(ids, ids[0])]
+        else:
+            ids = np.roll(ids, -cuts[0])
+            cuts = np.append(cuts - cuts[0], len(ids))
+            ids = np.append(ids, ids[0])
+            pieces = [ids[a:b + 1] for a, b in zip(cuts[:-1], cuts[1:])]
+
+        refs = []
+        for piece in pieces:
+            key = tuple(piece)
+            if key in arc_index:
+                refs.append((arc_index[key], False))
+            elif key[::-1] in arc_index:
+                refs.append((arc_index[key[::-1]], True))
+            else:
+                arc_index[key] = len(arcs)
+                arcs.append(point_coords[piece])
+                refs.append((arc_index[key], False))
+        ring_arcs.append(refs)
+    return arcs, ring_arcs
+
+
+def _douglas_peucker(points, tolerance):
+    """Mask of the points kept by Douglas-Peucker, the endpoints are always kept"""
+    # Degrees of longitude are shorter than degrees of latitude in Germany
+    points = points * [np.cos(np.radians(51)), 1]
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    if points[0].tolist() == points[-1].tolist() and len(points) > 4:
+        # Closed arc: keep two more points so the ring does not collapse
+        keep[[len(points) // 3, 2 * len(points) // 3]] = True
+
+    stack = [(i, j) for i, j in zip(np.flatnonzero(keep)[:-1], np.flatnonzero(keep)[1:])]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        start, end = points[a], points[b]
+        segment = points[a + 1:b]
+        direction = end - start
+        length = np.hypot(*direction)
+        if length == 0:
+            distance = np.hypot(*(segment - start).T)
+        else:
+            offset = segment - start
+            distance = np.abs(direction[0] * offset[:, 1] - direction[1] * offset[:, 0]) / length
+        i = distance.argmax()
+        if distance[i] > tolerance:
+            keep[a + 1 + i] = True
+            stack += [(a, a + 1 + i), (a + 1 + i, b)]
+    return keep
+
+
+def _quantize(points, decimals):
+    # Points on the grid of 10**-decimals degrees, in units of
+    # 10**-COORD_DECIMALS. The endpoints, where arcs meet, are on the
+    # finest grid in every level.
+    quantized = np.round(points * 10 ** decimals).astype(np.int64) * 10 ** (COORD_DECIMALS - decimals)
+    quantized[[0, -1]] = np.round(points[[0, -1]] * 10 ** COORD_DECIMALS)
+    # Drop points that fall together after quantization
+    quantized = quantized[np.append(True, (quantized[1:] != quantized[:-1]).any(axis=1))]
+    return quantized.astype(np.int32)
+
+
+def _simplify_rings(arcs, ring_arcs, tolerance, decimals, polygon_offsets, feature_offsets):
+    """Simplify every arc once and put the rings back together.
+
+    Simplifying the arcs one by one can make a ring cross itself or a
+    neighbouring ring, or collapse below 4 points. The arcs of every
+    district that ends up invalid are kept unsimplified and on the finest
+    grid, for its neighbours too, until all districts are valid.
+
+    Returns the quantized coordinates (int32, in units of
+    10**-COORD_DECIMALS degrees) and the ring offsets.
+    """
+    import shapely
+
+    polygon_feature = np.repeat(np.arange(len(feature_offsets) - 1), np.diff(feature_offsets))
+    ring_feature = np.repeat(polygon_feature, np.diff(polygon_offsets))
+    simplified = [_quantize(arc[_douglas_peucker(arc, tolerance)], decimals) for arc in arcs]
+    exact = np.zeros(len(arcs), dtype=bool)
+
+    while True:
+        rings = []
+        for refs in ring_arcs:
+            parts = [simplified[a][::-1] if rev else simplified[a] for a, rev in refs]
+            # Consecutive arcs share their endpoint
+            ring = np.concatenate([parts[0]] + [part[1:] for part in parts[1:]])
+            rings.append(ring)
+        offsets = np.concatenate([[0], np.cumsum([len(r) for r in rings])]).astype(np.int32)
+        coords = np.concatenate(rings)
+
+        short = np.diff(offsets) < 4
+        if short.any():
+            invalid = np.unique(ring_feature[short])
+        else:
+            features = shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON, coords.astype(np.float64),
+                                                 (offsets, polygon_offsets, feature_offsets))
+            invalid = np.flatnonzero(~shapely.is_valid(features))
+        fallback = [a for r in np.flatnonzero(np.isin(ring_feature, invalid)) for a, _ in ring_arcs[r]
+                    if not exact[a]]
+        if len(invalid) == 0 or not fallback:
+            return coords, offsets
+        for a in fallback:
+            simplified[a] = _quantize(arcs[a], COORD_DECIMALS)
+            exact[a] = True
+
+
+def read_geometry(level='full', path=GEOMETRY_PATH):
+    """Load a level of the geometry artifact ("full" or one of LEVELS),
+    building the artifact first if it does not exist"""
+    if not os.path.exists(path):
+        build_geometry(path=path)
+
+    with np.load(path) as data:
+        if level == 'full':
+            coords = data['coords'].tolist()
+            ring_offsets = data['ring_offsets'].tolist()
+        else:
+            coords = (data[f'{level}_coords'] / 10 ** COORD_DECIMALS).tolist()
+            ring_offsets = data[f'{level}_ring_offsets'].tolist()
+        polygon_offsets = data['polygon_offsets'].tolist()
+        feature_offsets = data['feature_offsets'].tolist()
+        districts = pd.DataFrame({name: data[name] for name in ATTRIBUTES})
+
+    properties = districts.astype({'WKR_NR': int}).to_dict('records')
+    features = []
+    for i, props in enumerate(properties):
+        polygons = [
+            [coords[ring_offsets[r]:ring_offsets[r + 1]]
+             for r in range(polygon_offsets[p], polygon_offsets[p + 1])]
+            for p in range(feature_offsets[i], feature_offsets[i + 1])
+        ]
+        if len(polygons) == 1:
+            geometry = {'type': 'Polygon', 'coordinates': polygons[0]}
+        else:
+            geometry = {'type': 'MultiPolygon', 'coordinates': polygons}
+        features.append({'type': 'Feature', 'id': str(i), 'properties': props, 'geometry': geometry})
+
+    geojson = {'type': 'FeatureCollection', 'features': features}
+    return Geometry(geojson, districts, len(json.dumps(geojson, separators=(',', ':'))))
+
+
+def _invalid_districts(geojson):
+    # Districts whose geometry is not valid (crossing or collapsed rings),
+    # None without shapely
+    try:
+        from shapely.geometry import shape
+    except ImportError:
+        return None
+    return sum(not shape(feature['geometry']).is_valid for feature in geojson['features'])
+
+
+def report():
+    """Payload size, figure build time and invalid districts of every level"""
+    from components.map import create_wahlkreis_map
+    from utils.snapshots import get_election_state
+
+    state = get_election_state()
+    rows = []
+    for level in ['full'] + list(LEVELS):
+        geometry = read_geometry(level)
+        payload = json.dumps(geometry.geojson, separators=(',', ':')).encode()
+        start = time.perf_counter()
+        fig, _ = create_wahlkreis_map(geometry.districts[['WKR_NR', 'WKR_NAME']], geometry.geojson, geometry.size,
+                                      state)
+        fig_json = fig.to_json()
+        render = time.perf_counter() - start
+        n_points = sum(len(ring) for f in geometry.geojson['features']
+                       for polygon in (f['geometry']['coordinates'] if f['geometry']['type'] == 'MultiPolygon'
+                                       else [f['geometry']['coordinates']])
+                       for ring in polygon)
+        rows.append({
+            'level': level,
+            'points': n_points,
+            'geojson_kb': len(payload) / 1000,
+            'gzip_kb': len(gzip.compress(payload)) / 1000,
+            'figure_kb': len(fig_json) / 1000,
+            'render_ms': render * 1000,
+            'invalid': _invalid_districts(geometry.geojson),
+        })
+    return pd.DataFrame(rows).set_index('level').round(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the district geometry artifact")
+    parser.add_argument('--report', action='store_true', help="report payload size and render time per level")
+    args = parser.parse_args()
+    if args.report:
+        print(report())
+    else:
+        print(build_geometry())
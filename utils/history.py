@@ -0,0 +1,244 @@
+# Counting progress over all snapshots
+#
+# Consecutive snapshots only differ in the districts that reported in
+# between. The history keeps the vote matrices of the first snapshot and,
+# for every later one, only the cells that changed (row, column, new
+# value). Walking the history applies the changes to one running matrix,
+# so all snapshots together cost about one snapshot of memory. The
+# timeline (reporting progress, national shares and seats at every
+# snapshot) is computed from that walk.
+#
+#     python -m utils.history --workers 8
+#
+# prints the timeline, with the seats computed in a process pool. The app
+# computes them serially, starting a pool per timeline is slower than that.
+
+import argparse
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.matrix import VoteMatrix, build_vote_matrix, find_winners
+from utils.seats import seats_from_totals
+from utils.store import read_snapshot, snapshot_files, snapshot_number, snapshot_time, snapshot_version
+
+STIMMEN = (1, 2)
+
+
+def _read_matrix(snapshot, stimme):
+    # Read directly from the store, going through the cached loaders would
+    # push the snapshots the app shows out of their caches
+    gruppenart = ['Partei', 'Einzelbewerber/Wählergruppe'] if stimme == 1 else ['Partei']
+    return build_vote_matrix(read_snapshot(snapshot, gebietsart='Wahlkreis', stimme=stimme, gruppenart=gruppenart))
+
+
+class Delta(NamedTuple):
+    """Cells of a (districts x parties) matrix that changed in one snapshot"""
+    rows: np.ndarray
+    cols: np.ndarray
+    values: np.ndarray
+
+
+@dataclass
+class History:
+    """Vote matrices of all snapshots as a base plus one Delta per snapshot and Stimme"""
+    snapshots: list
+    # (path, version) of every snapshot, to tell whether a file changed
+    versions: list
+    districts: np.ndarray
+    lands: np.ndarray
+    # Parties of every Stimme, new parties are appended as they show up
+    parties: dict
+    # Stimme -> matrix of the first snapshot
+    base: dict
+    # Stimme -> one Delta per later snapshot
+    deltas: dict
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def matrices(self, stimme):
+        """Matrix of every snapshot in order. The same array is updated in
+        place between steps, copy it to keep one."""
+        base = self.base[stimme]
+        values = np.pad(base, ((0, 0), (0, len(self.parties[stimme]) - base.shape[1])))
+        yield values
+        for delta in self.deltas[stimme]:
+            values[delta.rows, delta.cols] = delta.values
+            yield values
+
+    def newest(self, stimme):
+        """Matrix of the newest snapshot, rebuilt from the deltas"""
+        for values in self.matrices(stimme):
+            pass
+        return values
+
+    def head(self, n):
+        """History of the first n snapshots, sharing the arrays"""
+        return History(self.snapshots[:n], self.versions[:n], self.districts, self.lands, self.parties,
+                       self.base, {stimme: deltas[:n - 1] for stimme, deltas in self.deltas.items()})
+
+    @property
+    def nbytes(self):
+        """Memory of the base matrices and the deltas"""
+        base = sum(matrix.nbytes for matrix in self.base.values())
+        return base + sum(sum(array.nbytes for array in delta) for deltas in self.deltas.values() for delta in deltas)
+
+
+def _widen(values, parties, matrix):
+    # Place a VoteMatrix on the district rows and party columns of the
+    # history, appending parties it has not seen yet
+    known = {party: i for i, party in enumerate(parties)}
+    for party in matrix.parties:
+        if party not in known:
+            known[party] = len(parties)
+            parties.append(party)
+    cols = np.array([known[party] for party in matrix.parties], dtype=np.int64)
+    widened = np.zeros((len(values), len(parties)), dtype=np.int64)
+    widened[:, cols] = matrix.values
+    return widened
+
+
+def _append(history, snapshot):
+    for stimme in STIMMEN:
+        matrix = _read_matrix(snapshot, stimme)
+        if not np.array_equal(matrix.districts, history.districts):
+            raise ValueError(f"{snapshot} has other Wahlkreise than the history")
+        # The newest matrix is not kept, it would double the memory of
+        # the history
+        last = history.newest(stimme)
+        values = _widen(last, history.parties[stimme], matrix)
+        last = np.pad(last, ((0, 0), (0, values.shape[1] - last.shape[1])))
+        rows, cols = np.nonzero(values != last)
+        history.deltas[stimme].append(Delta(rows.astype(np.int32), cols.astype(np.int32), values[rows, cols]))
+    history.snapshots.append(snapshot)
+    history.versions.append((snapshot, snapshot_version(snapshot)))
+
+
+def build_history(snapshots):
+    """Build the History of the given snapshots, oldest first"""
+    first = {stimme: _read_matrix(snapshots[0], stimme) for stimme in STIMMEN}
+    history = History(
+        snapshots=[snapshots[0]],
+        versions=[(snapshots[0], snapshot_version(snapshots[0]))],
+        districts=first[1].districts,
+        lands=first[1].lands,
+        parties={stimme: list(matrix.parties) for stimme, matrix in first.items()},
+        base={stimme: matrix.values for stimme, matrix in first.items()},
+        deltas={stimme: [] for stimme in STIMMEN},
+    )
+    for snapshot in snapshots[1:]:
+        _append(history, snapshot)
+    return history
+
+
+def extend_history(history, snapshots):
+    """History of snapshots, reusing history if it covers a prefix of them
+    unchanged. The result may cover more snapshots if history already does."""
+    versions = [(snapshot, snapshot_version(snapshot)) for snapshot in snapshots]
+    if history is not None and history.versions[:len(versions)] == versions:
+        return history
+    if history is None or versions[:len(history)] != history.versions:
+        return build_history(snapshots)
+    for snapshot in snapshots[len(history):]:
+        _append(history, snapshot)
+    return history
+
+
+class Timeline(NamedTuple):
+    # Per snapshot number: Stand (time of the snapshot), Gezählt (districts
+    # with results) and Anteil (their share of all districts, in percent)
+    progress: pd.DataFrame
+    # Share of the second votes in percent, snapshot number x Gruppenname
+    shares: pd.DataFrame
+    # Projected seats, snapshot number x Gruppenname
+    seats: pd.DataFrame
+
+
+def _seats_at(args):
+    totals, winners = args
+    seats = seats_from_totals(totals, winners)
+    return seats.set_index('Gruppenname')['Sitze']
+
+
+def build_timeline(history, workers=None):
+    """Progress, national shares and seats at every snapshot of the history.
+
+    Pass workers to compute the seats in a process pool, for the command line.
+    """
+    numbers = [snapshot_number(snapshot) for snapshot in history.snapshots]
+    first_parties = np.asarray(history.parties[1], dtype=object)
+    second_parties = history.parties[2]
+
+    counted, shares, tasks = [], [], []
+    for first, second in zip(history.matrices(1), history.matrices(2)):
+        counted.append(int((first.sum(axis=1) > 0).sum()))
+        totals = second.sum(axis=0)
+        shares.append(totals / totals.sum() * 100 if totals.sum() else np.zeros(len(totals)))
+        # Only the small per-snapshot inputs of the seat calculation are kept
+        winners = find_winners(VoteMatrix(first, history.districts, first_parties[:first.shape[1]], history.lands))
+        tasks.append((pd.DataFrame({'Gruppenname': second_parties[:len(totals)], 'Anzahl': totals}), winners))
+
+    if workers and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            seats = list(executor.map(_seats_at, tasks))
+    else:
+        seats = [_seats_at(task) for task in tasks]
+
+    index = pd.Index(numbers, name='Snapshot')
+    progress = pd.DataFrame({
+        'Stand': [snapshot_time(snapshot) for snapshot in history.snapshots],
+        'Gezählt': counted,
+        'Anteil': np.array(counted) / len(history.districts) * 100,
+    }, index=index)
+    width = len(second_parties)
+    shares = pd.DataFrame([np.pad(row, (0, width - len(row))) for row in shares], index=index,
+                          columns=pd.Index(second_parties, name='Gruppenname'))
+    seats = pd.DataFrame(seats, index=index).fillna(0).astype(int)
+    seats.columns.name = 'Gruppenname'
+    return Timeline(progress, shares, seats)
+
+
+@st.cache_resource
+def _history_holder():
+    # Shared by all sessions, extended when new snapshots arrive
+    return {'history': None, 'lock': threading.Lock()}
+
+
+def get_history(snapshot=None):
+    """History of the snapshots in results/ up to snapshot (default: the
+    newest), it may cover later ones (shared, do not modify)"""
+    files = snapshot_files()
+    if snapshot is not None:
+        files = [f for f in files if snapshot_number(f) <= snapshot_number(snapshot)]
+    holder = _history_holder()
+    with holder['lock']:
+        holder['history'] = extend_history(holder['history'], files)
+        return holder['history']
+
+
+def get_timeline(snapshot=None, version=None):
+    """Timeline of all snapshots up to snapshot (default: the newest), at
+    its version (shared, do not modify)"""
+    snapshot = snapshot or snapshot_files()[-1]
+    return _get_timeline(snapshot, version or snapshot_version(snapshot))
+
+@st.cache_resource(max_entries=1)
+def _get_timeline(snapshot, version):
+    history = get_history(snapshot)
+    return build_timeline(history.head(history.snapshots.index(snapshot) + 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Counting progress, shares and seats at every snapshot")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    timeline = build_timeline(build_history(snapshot_files()), args.workers)
+    for frame in timeline:
+        print(frame.to_string())
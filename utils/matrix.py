@@ -0,0 +1,118 @@
+# Dense district x party vote matrix
+#
+# The long kerg2 frame (one row per district, party and Stimme) is turned
+# into a NumPy matrix with one row per Wahlkreis and one column per party.
+# District winners and everything derived from them come from a single
+# argmax over that matrix instead of a groupby per district.
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class VoteMatrix:
+    """Votes of one Stimme as a (districts x parties) matrix"""
+    # Vote counts, 0 where a district has not reported yet
+    values: np.ndarray
+    # Gebietsnummer of each row
+    districts: np.ndarray
+    # Gruppenname of each column, in ballot order (Gruppenreihenfolge)
+    parties: np.ndarray
+    # Land number (1-16) of each row
+    lands: np.ndarray
+
+    @property
+    def district_index(self):
+        return {d: i for i, d in enumerate(self.districts)}
+
+    @property
+    def party_index(self):
+        return {p: i for i, p in enumerate(self.parties)}
+
+    def to_frame(self):
+        return pd.DataFrame(self.values, index=pd.Index(self.districts, name='Gebietsnummer'),
+                            columns=pd.Index(self.parties, name='Gruppenname'))
+
+
+def ballot_order(votes):
+    """Gruppenname of the parties in votes by Gruppenreihenfolge, ties by name"""
+    order = votes.groupby('Gruppenname', observed=True)['Gruppenreihenfolge'].min()
+    # Categorical groups come in category order, sort them by name first
+    order.index = order.index.astype(object)
+    return order.sort_index().sort_values(kind='stable').index.to_numpy(dtype=object)
+
+
+def build_vote_matrix(votes):
+    """Build a VoteMatrix from a frame like get_first_votes() or get_second_votes()"""
+    districts, rows = np.unique(votes['Gebietsnummer'].to_numpy(), return_inverse=True)
+
+    # Columns in ballot order, so ties go to the party listed first like
+    # in the official results
+    parties = ballot_order(votes)
+    cols = pd.Categorical(votes['Gruppenname'], categories=parties).codes
+
+    values = np.zeros((len(districts), len(parties)), dtype=np.int64)
+    values[rows, cols] = votes['Anzahl'].fillna(0).to_numpy(dtype=np.int64)
+    values.setflags(write=False)
+
+    lands = np.zeros(len(districts), dtype=np.int8)
+    lands[rows] = votes['UegGebietsnummer'].to_numpy()
+    return VoteMatrix(values=values, districts=districts, parties=parties, lands=lands)
+
+
+def land_totals(matrix):
+    """Sum the district rows per Land, shape (16 x parties)"""
+    totals = np.zeros((16, len(matrix.parties)), dtype=np.int64)
+    np.add.at(totals, matrix.lands - 1, matrix.values)
+    return totals
+
+
+def find_winners(matrix, rows=None):
+    """Winner of each district from one argmax pass.
+
+    Returns a frame indexed by Gebietsnummer with the columns
+    - winner: Gruppenname of the winner, "" if there are no results yet
+    - label: like winner, but "EB" for Einzelbewerber and "Keine Ergebnisse"
+      for districts without results
+    - independent: the winner is an Einzelbewerber or the SSW
+    Pass row positions to only look at some districts.
+    """
+    values = matrix.values if rows is None else matrix.values[rows]
+    districts = matrix.districts if rows is None else matrix.districts[rows]
+
+    has_results = values.sum(axis=1) > 0
+    winner = matrix.parties[values.argmax(axis=1)] if len(matrix.parties) else np.full(len(values), '')
+    winner = np.where(has_results, winner, '')
+
+    is_eb = np.char.startswith(winner.astype(str), 'EB:')
+    label = np.where(is_eb, 'EB', np.where(has_results, winner, 'Keine Ergebnisse'))
+
+    return pd.DataFrame({
+        'winner': winner,
+        'label': label,
+        'independent': is_eb | (winner == 'SSW'),
+    }, index=pd.Index(districts, name='Gebietsnummer'))
+
+
+def top_shares(matrix, n=3):
+    """Gruppenname and share (in percent) of the n strongest parties of each district.
+
+    Returns two (districts x n) arrays, "" and NaN where a district has
+    fewer than n parties with votes. Ties go to the earlier party on the
+    ballot, like in find_winners.
+    """
+    values = matrix.values
+    n = min(n, values.shape[1])
+    order = np.argsort(-values, axis=1, kind='stable')[:, :n]
+    top = np.take_along_axis(values, order, axis=1)
+    valid = values.sum(axis=1, keepdims=True)
+    shares = np.where(top > 0, top / np.where(valid > 0, valid, 1) * 100, np.nan)
+    parties = np.where(top > 0, matrix.parties[order], '')
+    return parties, shares
+
+
+def winners_per_party(winners):
+    """Number of won districts per Gruppenname"""
+    return winners.loc[winners['winner'] != '', 'winner'].value_counts()
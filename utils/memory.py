@@ -0,0 +1,114 @@
+# Memory of the shared data layer and of the sessions
+#
+# The frames, matrices and figures are shared by all sessions of a process,
+# a session itself only holds its widget state. The report lists both, so
+# it is visible when something starts to be copied per session again.
+#
+#     python -m utils.memory --sessions 100
+#
+# runs the app that many times in one process and prints the resident
+# memory, which should stay flat after the first session.
+
+import argparse
+import pickle
+import resource
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def _column_nbytes(values):
+    # Deep size of a column or index. memory_usage(deep=True) can not read
+    # the read-only object arrays of the shared frames.
+    if values.dtype == object:
+        array = values.to_numpy()
+        return array.nbytes + sum(sys.getsizeof(value) for value in array)
+    if isinstance(values, pd.Index):
+        return int(values.memory_usage(deep=True))
+    return int(values.memory_usage(deep=True, index=False))
+
+
+def nbytes(obj):
+    """Approximate memory of a frame, array or a container of them"""
+    if isinstance(obj, pd.DataFrame):
+        return sum(_column_nbytes(obj.iloc[:, i]) for i in range(obj.shape[1])) + _column_nbytes(obj.index)
+    if isinstance(obj, pd.Series):
+        return _column_nbytes(obj) + _column_nbytes(obj.index)
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(nbytes(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(value) for value in obj)
+    if hasattr(obj, '__dict__'):
+        return nbytes(vars(obj))
+    return sys.getsizeof(obj)
+
+
+def process_memory():
+    """Resident and peak resident memory of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            resident = int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        resident = peak
+    return resident, peak
+
+
+def shared_memory(snapshot=None):
+    """Bytes of the shared objects of a snapshot, as a Series by name"""
+    from utils.data_loader import get_district_winners, get_first_votes, get_second_votes, get_vote_matrix, \
+        load_candidates
+    from utils.district_index import get_district_index
+    from utils.figure_cache import get_figure_cache
+    from utils.rollup import get_rollup
+
+    index = get_district_index(snapshot)
+    return pd.Series({
+        'Erststimmen': nbytes(get_first_votes(snapshot)),
+        'Zweitstimmen': nbytes(get_second_votes(snapshot)),
+        'Matrizen': nbytes(get_vote_matrix(1, snapshot)) + nbytes(get_vote_matrix(2, snapshot)),
+        'Wahlkreisgewinner': nbytes(get_district_winners(snapshot)),
+        'Bewerber': nbytes(load_candidates()),
+        'Wahlkreisindex': nbytes(index.sorted_votes),
+        'Rollup': nbytes(get_rollup(snapshot).tables),
+        'Abbildungen': get_figure_cache().nbytes,
+    }, name='Bytes')
+
+
+def session_memory(session_state):
+    """Bytes of a session's state, as pickled"""
+    size = 0
+    for key in session_state:
+        try:
+            size += len(pickle.dumps(session_state[key]))
+        except Exception:
+            size += sys.getsizeof(session_state[key])
+    return size
+
+
+def run_sessions(n_sessions, step=10, script='app.py'):
+    """Resident memory after every step sessions of the app in this process"""
+    from streamlit.testing.v1 import AppTest
+
+    rows = []
+    for i in range(1, n_sessions + 1):
+        AppTest.from_file(script, default_timeout=120).run()
+        if i == 1 or i % step == 0:
+            resident, peak = process_memory()
+            rows.append({'Sitzungen': i, 'RSS_MB': resident / 2**20, 'Peak_MB': peak / 2**20})
+    return pd.DataFrame(rows).set_index('Sitzungen')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory of the shared data and of repeated sessions")
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--step', type=int, default=10)
+    args = parser.parse_args()
+
+    from streamlit.logger import set_log_level
+    set_log_level('error')
+    print(run_sessions(args.sessions, args.step).round(1).to_string())
+    print((shared_memory() / 2**20).round(2).rename('MB').to_string())
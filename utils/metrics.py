@@ -0,0 +1,184 @@
+# Timing spans and cache counters
+#
+# Turned on with METRICS=1. The components and data-layer calls are
+# decorated with @timed, the bodies of the cached loaders with
+# @cache_miss; when metrics are off both return the function unchanged, so
+# there is no overhead at all. When on, every call adds to a process-wide
+# histogram and to the span list of the current rerun, which the debug
+# panel (?debug, see components/debug.py) shows. The registry is written
+# in the Prometheus text format to METRICS_FILE (e.g. for the node
+# exporter's textfile collector) at the end of a rerun.
+
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+ENABLED = os.environ.get('METRICS', '') not in ('', '0')
+METRICS_FILE = os.environ.get('METRICS_FILE')
+# At most one write of METRICS_FILE per this many seconds
+WRITE_INTERVAL = 5
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Registry:
+    """Span histograms and cache counters of this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> counts per bucket, the last one is +Inf
+        self.buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self.sums = defaultdict(float)
+        self.misses = defaultdict(int)
+        self.written = 0.0
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.buckets[name][bisect.bisect_left(BUCKETS, seconds)] += 1
+            self.sums[name] += seconds
+
+    def miss(self, name):
+        with self.lock:
+            self.misses[name] += 1
+
+    def calls(self, name):
+        return sum(self.buckets[name]) if name in self.buckets else 0
+
+    def cache_counters(self):
+        """name -> (hits, misses) of the cached calls"""
+        with self.lock:
+            return {name: (max(0, self.calls(name) - misses), misses) for name, misses in self.misses.items()}
+
+    def prometheus(self, figure_cache=None):
+        """The registry in the Prometheus text format"""
+        lines = ['# HELP btw_span_seconds Duration of instrumented calls',
+                 '# TYPE btw_span_seconds histogram']
+        with self.lock:
+            for name, counts in sorted(self.buckets.items()):
+                total = 0
+                for bound, count in zip(BUCKETS + (float('inf'),), counts):
+                    total += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'btw_span_seconds_bucket{{span="{name}",le="{le}"}} {total}')
+                lines.append(f'btw_span_seconds_sum{{span="{name}"}} {self.sums[name]:.6f}')
+                lines.append(f'btw_span_seconds_count{{span="{name}"}} {total}')
+        counters = self.cache_counters()
+        if figure_cache is not None:
+            counters['figures'] = (figure_cache.hits, figure_cache.misses)
+        for result, column in [('hits', 0), ('misses', 1)]:
+            lines += [f'# HELP btw_cache_{result}_total Cache {result} of the shared caches',
+                      f'# TYPE btw_cache_{result}_total counter']
+            lines += [f'btw_cache_{result}_total{{cache="{name}"}} {counts[column]}'
+                      for name, counts in sorted(counters.items())]
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Spans of the rerun running in this thread and the names of the open spans
+_local = threading.local()
+
+
+def _open_spans():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def begin_rerun():
+    """Start collecting the spans of a new rerun in this thread"""
+    if ENABLED:
+        _local.spans = []
+        _local.start = time.perf_counter()
+
+
+def rerun_spans():
+    """(name, depth, seconds) of the spans of the current rerun, in the order they started"""
+    return list(getattr(_local, 'spans', []))
+
+
+def rerun_seconds():
+    start = getattr(_local, 'start', None)
+    return None if start is None else time.perf_counter() - start
+
+
+@contextmanager
+def _span(name):
+    stack = _open_spans()
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        entry = [name, len(stack), 0.0]
+        spans.append(entry)
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        REGISTRY.observe(name, seconds)
+        if spans is not None:
+            entry[2] = seconds
+
+
+def span(name):
+    """Context manager timing a block as the span name"""
+    return _span(name) if ENABLED else nullcontext()
+
+
+def timed(name=None):
+    """Time every call of the decorated function as a span"""
+    def decorate(func):
+        if not ENABLED:
+            return func
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def cache_miss(name):
+    """Count the calls of a cached function's body as misses of the span name.
+
+    Goes between the cache decorator and the function. Only calls made
+    directly from within the span count, so the hits are the calls of the
+    span minus the misses; calls from other cached functions count as
+    neither.
+    """
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = _open_spans()
+            if stack and stack[-1] == name:
+                REGISTRY.miss(name)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def write_metrics(path=METRICS_FILE, figure_cache=None, force=False):
+    """Write the registry to path, at most every WRITE_INTERVAL seconds"""
+    if not ENABLED or not path:
+        return False
+    now = time.monotonic()
+    if not force and now - REGISTRY.written < WRITE_INTERVAL:
+        return False
+    REGISTRY.written = now
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.prometheus(figure_cache))
+    os.replace(tmp, path)
+    return True
@@ -0,0 +1,106 @@
+# Local stand-in for the results server of the Bundeswahlleiterin
+#
+# Serves the bundled kerg2 snapshots one after the other under a single URL,
+# with ETag and Last-Modified headers and 304 answers to conditional
+# requests, so utils/fetcher.py can be tried out and tested offline.
+#
+#     python -m utils.results_server --interval 20
+#     python -m utils.fetcher --url http://localhost:8600/kerg2.csv --results-dir /tmp/results
+
+import argparse
+import hashlib
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.store import snapshot_files
+
+PORT = 8600
+PATH = '/kerg2.csv'
+
+
+class ResultsServer(ThreadingHTTPServer):
+    """Serves files[0], files[1], ... at PATH, moving on every interval seconds or on advance()"""
+
+    def __init__(self, files, address=('127.0.0.1', PORT), interval=None):
+        super().__init__(address, ResultsHandler)
+        self.files = list(files)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.requests = 0
+        self._show(0)
+
+    def _show(self, position):
+        with open(self.files[position], 'rb') as f:
+            self.body = f.read()
+        self.position = position
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        self.modified = int(time.time())
+        self.shown_at = time.monotonic()
+
+    def advance(self):
+        """Serve the next snapshot, returns False after the last one"""
+        with self.lock:
+            if self.position + 1 >= len(self.files):
+                return False
+            self._show(self.position + 1)
+            return True
+
+    def current(self):
+        if self.interval is not None and time.monotonic() - self.shown_at >= self.interval:
+            self.advance()
+        with self.lock:
+            self.requests += 1
+            return self.body, self.etag, self.modified
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}{PATH}'
+
+
+class ResultsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != PATH:
+            self.send_error(404)
+            return
+        body, etag, modified = self.server.current()
+
+        if self._not_modified(etag, modified):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(modified, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_modified(self, etag, modified):
+        if 'If-None-Match' in self.headers:
+            return self.headers['If-None-Match'] == etag
+        if 'If-Modified-Since' in self.headers:
+            try:
+                return parsedate_to_datetime(self.headers['If-Modified-Since']).timestamp() >= modified
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the bundled kerg2 snapshots in sequence")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--interval', type=float, default=20, help="seconds until the next snapshot")
+    args = parser.parse_args()
+
+    server = ResultsServer(snapshot_files(), ('127.0.0.1', args.port), args.interval)
+    print(f"serving {len(server.files)} snapshots at {server.url}")
+    server.serve_forever()
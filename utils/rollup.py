@@ -0,0 +1,107 @@
+# Bund / Land / Wahlkreis rollup of the votes
+#
+# The kerg2 files contain the official Land and Bund aggregates next to the
+# Wahlkreis rows. They are used as they are, cross-checked once against the
+# sums of the districts, and kept as one (areas x parties) table per level
+# and Stimme. National and Land totals are then lookups instead of a
+# groupby over all district rows.
+
+from dataclasses import dataclass
+
+import pandas as pd
+import streamlit as st
+
+from utils.matrix import ballot_order
+from utils.store import RETAINED_SNAPSHOTS, newest_snapshot, read_only, read_snapshot, snapshot_version
+
+LEVELS = ['Bund', 'Land', 'Wahlkreis']
+
+# The Land and Bund rows combine all Einzelbewerber under this name
+EINZELBEWERBER = 'Einzelbewerber/Wählergruppe'
+
+BUND = 99
+
+KEYS = ['Gebietsart', 'Gebietsnummer', 'Gruppenname', 'Stimme']
+
+
+@dataclass(frozen=True)
+class RollupCube:
+    """Votes per level, area, party and Stimme"""
+    # (Gebietsart, Stimme) -> frame with one row per Gebietsnummer and one
+    # column per Gruppenname on the ballot in ballot order, NaN where
+    # nothing is counted yet (the column is kept, so the party shows with 0)
+    tables: dict
+    # (Gebietsart, Gebietsnummer) -> Gebietsname
+    names: dict
+    # Official aggregates that differ from the sum of their districts, with
+    # the columns KEYS, Anzahl (official) and Summe (districts)
+    mismatches: pd.DataFrame
+
+    def table(self, level, stimme):
+        return self.tables[(level, stimme)]
+
+    def totals(self, level, area, stimme):
+        """Votes per Gruppenname in one area, 0 for parties without results"""
+        return self.tables[(level, stimme)].loc[area].fillna(0).astype(int)
+
+    def national(self, stimme):
+        return self.totals('Bund', BUND, stimme)
+
+    def land(self, land, stimme):
+        return self.totals('Land', land, stimme)
+
+    def areas(self, level):
+        """Gebietsnummer and Gebietsname of the areas of a level"""
+        return {nr: name for (lvl, nr), name in self.names.items() if lvl == level}
+
+
+def cross_check(votes):
+    """Compare the official Land and Bund rows with the sums of their districts.
+
+    Returns the sums per (Gebietsart, Gebietsnummer, Gruppenname, Stimme)
+    and the rows where they differ. Missing counts compare as 0.
+    """
+    districts = votes[votes['Gebietsart'] == 'Wahlkreis']
+    party = districts['Gruppenname'].where(districts['Gruppenart'] != EINZELBEWERBER, EINZELBEWERBER)
+    sums = pd.concat([
+        districts.assign(Gebietsart='Land', Gebietsnummer=districts['UegGebietsnummer'], Gruppenname=party),
+        districts.assign(Gebietsart='Bund', Gebietsnummer=BUND, Gruppenname=party),
+    ]).groupby(KEYS, observed=True)['Anzahl'].sum(min_count=1)
+
+    official = votes[votes['Gebietsart'] != 'Wahlkreis'].set_index(KEYS)['Anzahl']
+    joined = pd.concat([official, sums.rename('Summe')], axis=1)
+    differs = joined['Anzahl'].fillna(0) != joined['Summe'].fillna(0)
+    return sums, joined[differs].reset_index()
+
+
+def build_rollup(votes):
+    """Build the RollupCube from the party rows of all Gebietsarten of a snapshot"""
+    votes = votes[votes['Gruppenart'] != 'System-Gruppe']
+    sums, mismatches = cross_check(votes)
+
+    # Official aggregates where they exist, the district sums otherwise
+    indexed = votes.set_index(KEYS)['Anzahl']
+    aggregates = indexed[indexed.index.get_level_values('Gebietsart') != 'Wahlkreis']
+    cube = pd.concat([indexed, sums[~sums.index.isin(aggregates.index)]])
+
+    order = ballot_order(votes)
+    tables = {}
+    for (level, stimme), group in cube.groupby(level=['Gebietsart', 'Stimme'], observed=True):
+        table = group.droplevel(['Gebietsart', 'Stimme']).unstack('Gruppenname')
+        table = table[[party for party in order if party in table.columns]]
+        table.index = table.index.astype(int)
+        tables[(level, int(stimme))] = read_only(table.sort_index())
+
+    names = votes.drop_duplicates(['Gebietsart', 'Gebietsnummer'])
+    names = dict(zip(zip(names['Gebietsart'], names['Gebietsnummer'].astype(int)), names['Gebietsname']))
+    return RollupCube(tables=tables, names=names, mismatches=mismatches)
+
+
+def get_rollup(snapshot=None):
+    """RollupCube of a snapshot (shared, do not modify)"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_rollup(snapshot, snapshot_version(snapshot))
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+def _get_rollup(snapshot, version):
+    return build_rollup(read_snapshot(snapshot, gruppenart=['Partei', EINZELBEWERBER]))
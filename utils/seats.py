@@ -2,8 +2,23 @@
 
 # This is based on the Bundeswahlgesetz (BWG)
 
+import heapq
+from fractions import Fraction
+from typing import NamedTuple, Optional
+
+import numpy as np
 import pandas as pd
-from utils.data_loader import get_second_votes, get_first_votes
+import streamlit as st
+from utils.data_loader import get_district_winners, get_vote_matrix
+from utils.matrix import land_totals, winners_per_party
+from utils.metrics import cache_miss, timed
+from utils.store import RETAINED_SNAPSHOTS, newest_snapshot, read_only, snapshot_version
+
+# Land numbers used in the kerg2 files
+LAENDER = {
+    1: 'SH', 2: 'HH', 3: 'NI', 4: 'HB', 5: 'NW', 6: 'HE', 7: 'RP', 8: 'BW',
+    9: 'BY', 10: 'SL', 11: 'BE', 12: 'BB', 13: 'MV', 14: 'SN', 15: 'ST', 16: 'TH'
+}
 
 def combine_cdu_csu(total_by_party):
     cdu_csu_mask = total_by_party['Gruppenname'].isin(['CDU', 'CSU'])
@@ -20,34 +35,21 @@ def combine_cdu_csu(total_by_party):
     ])
     return total_by_party
 
-def calculate_winner(votes):
-    # if they are empty, return empty string or nan
-    sum_votes = votes.Anzahl.sum()
-    if pd.isna(sum_votes) or sum_votes == 0:
-        return ""
-    return votes.loc[votes['Anzahl'].idxmax(), 'Gruppenname']
-
-def n_independent_mandates():
+def n_independent_mandates(district_winners=None):
     # these are the mandates that are not allocated by the party list
-    votes = get_first_votes()
-
-    district_winners = votes.groupby('Gebietsnummer').apply(calculate_winner)
-    # now, count the number of independent mandates
-    # count the number of "EB:*" in the district_winners
-    independent_mandates = district_winners[district_winners.str.contains('EB:')].count()
-    # count the SSW as a "Partei nationaler Minderheiten" 
-    independent_mandates += district_winners[district_winners.str.contains('SSW')].count()
-    return independent_mandates
+    if district_winners is None:
+        district_winners = get_district_winners()
+    # independent mandates have the party name "EB:*", and the SSW counts
+    # as a "Partei nationaler Minderheiten" (see matrix.find_winners)
+    return int(district_winners['independent'].sum())
 
-    # independent mandates have the party name "EB:*"
-
-def five_percent_rule(total_by_party):
+def five_percent_rule(total_by_party, district_winners=None):
     # Get first votes to check wahlkreis winners
-    first_votes = get_first_votes()
-    district_winners = first_votes.groupby('Gebietsnummer').apply(calculate_winner)
+    if district_winners is None:
+        district_winners = get_district_winners()
     
     # Count wahlkreis winners per party
-    wahlkreis_winners = district_winners.value_counts()
+    wahlkreis_winners = winners_per_party(district_winners)
     
     # Calculate total votes
     total_votes = total_by_party['Anzahl'].sum()
@@ -66,58 +68,232 @@ def five_percent_rule(total_by_party):
     return total_by_party
 
 
-def custom_round(x):
-    i = int(x)
-    f = x - i
-    if f > 0.5:
-        return i + 1
-    if f < 0.5:
-        return i
-    return i  # Bei exakt 0.5 könnte man ein Losverfahren einbauen
+class Apportionment(NamedTuple):
+    seats: list
+    # Any divisor in the open interval gives the same seats, this is its
+    # midpoint. None if there are no seats or votes to distribute.
+    divisor: Optional[Fraction]
+    # Positions of the parties that tie for the last seat(s). The BWG
+    # decides these by lot, here the party listed first gets the seat.
+    ties: list
+
+
+def _round_half_down(numerator, denominator):
+    # Round numerator/denominator to the nearest integer, exactly .5 rounds down
+    i, rest = divmod(numerator, denominator)
+    return i + 1 if 2 * rest > denominator else i
+
+
+def sainte_lague(votes, total_seats) -> Apportionment:
+    """
+    Distribute total_seats by Sainte-Laguë/Schepers (§ 5 BWG) in exact
+    integer arithmetic.
+
+    The seats for the standard divisor (votes / seats) are off by at most
+    a few seats, which are then handed out or taken back along the
+    highest-averages sequence v / (s + 0.5).
+    """
+    votes = [int(v) for v in votes]
+    total_votes = sum(votes)
+    if total_seats <= 0 or total_votes == 0:
+        return Apportionment([0] * len(votes), None, [])
+
+    seats = [_round_half_down(v * total_seats, total_votes) for v in votes]
+    assigned = sum(seats)
+
+    # Comparing v / (2s + 1) is the same as comparing v / (s + 0.5)
+    if assigned < total_seats:
+        heap = [(-Fraction(v, 2 * s + 1), i) for i, (v, s) in enumerate(zip(votes, seats))]
+        heapq.heapify(heap)
+        for _ in range(total_seats - assigned):
+            _, i = heapq.heappop(heap)
+            seats[i] += 1
+            heapq.heappush(heap, (-Fraction(votes[i], 2 * seats[i] + 1), i))
+    elif assigned > total_seats:
+        heap = [(Fraction(v, 2 * s - 1), -i) for i, (v, s) in enumerate(zip(votes, seats)) if s > 0]
+        heapq.heapify(heap)
+        for _ in range(assigned - total_seats):
+            _, i = heapq.heappop(heap)
+            seats[-i] -= 1
+            if seats[-i] > 0:
+                heapq.heappush(heap, (Fraction(votes[-i], 2 * seats[-i] - 1), i))
+
+    # Weakest quotient that got a seat and strongest one that did not
+    last = min(Fraction(v, 2 * s - 1) for v, s in zip(votes, seats) if s > 0)
+    next_ = max(Fraction(v, 2 * s + 1) for v, s in zip(votes, seats))
+    ties = []
+    if last == next_:
+        ties = [i for i, (v, s) in enumerate(zip(votes, seats))
+                if (s > 0 and Fraction(v, 2 * s - 1) == last) or Fraction(v, 2 * s + 1) == next_]
+    # v / d rounds to s for every d in [2 * next_, 2 * last]
+    return Apportionment(seats, last + next_, ties)
+
+
+def sainte_lague_batch(votes, total_seats):
+    """
+    Sainte-Laguë for many seat problems at once.
+
+    votes is an array of shape (problems, parties), total_seats a number or
+    one per problem. Returns the seats with the same shape as votes. Works
+    in floating point. Exact ties go to the party listed first, like in
+    sainte_lague, both when handing out and when taking back seats.
+    """
+    votes = np.asarray(votes, dtype=np.float64)
+    n_problems = votes.shape[0]
+    total_seats = np.broadcast_to(np.asarray(total_seats, dtype=np.int64), (n_problems,))
+    total_votes = votes.sum(axis=1)
+    has_votes = total_votes > 0
+
+    quota = votes * (total_seats / np.where(has_votes, total_votes, 1))[:, None]
+    seats = np.floor(quota)
+    seats += (quota - seats) > 0.5
+    seats = seats.astype(np.int64)
+    missing = np.where(has_votes, total_seats - seats.sum(axis=1), 0)
+
+    # The standard divisor is off by at most a few seats per problem, so
+    # this loops a handful of times over all problems together
+    while (missing > 0).any():
+        rows = np.flatnonzero(missing > 0)
+        cols = (votes[rows] / (2 * seats[rows] + 1)).argmax(axis=1)
+        seats[rows, cols] += 1
+        missing[rows] -= 1
+    while (missing < 0).any():
+        rows = np.flatnonzero(missing < 0)
+        with np.errstate(divide='ignore'):
+            quotients = np.where(seats[rows] > 0, votes[rows] / (2 * seats[rows] - 1), np.inf)
+        # The last of the tied parties gives its seat back
+        cols = quotients.shape[1] - 1 - quotients[:, ::-1].argmin(axis=1)
+        seats[rows, cols] -= 1
+        missing[rows] += 1
+    return seats
 
-def seats_for_divisor(votes, divisor):
-    return [custom_round(v/divisor) for v in votes]
 
 def allocate_seats(df, total_seats):
-    votes = df['Anzahl'].tolist()
-    low = 0.000001
-    high = max(votes)
-    for _ in range(200):
-        mid = (low + high) / 2
-        alloc = seats_for_divisor(votes, mid)
-        s = sum(alloc)
-        if s > total_seats:
-            low = mid
-        elif s < total_seats:
-            high = mid
-        else:
-            break
-    final_alloc = seats_for_divisor(votes, mid)
-    return pd.DataFrame({
+    """
+    Distribute total_seats among the parties in df (columns Gruppenname,
+    Anzahl). The divisor and the parties tied for the last seat are
+    returned in the attrs of the result.
+    """
+    result = sainte_lague(df['Anzahl'].tolist(), total_seats)
+    seats = pd.DataFrame({
         'Gruppenname': df['Gruppenname'],
-        'Sitze': final_alloc
+        'Sitze': result.seats
     })
+    seats.attrs['divisor'] = float(result.divisor) if result.divisor is not None else None
+    seats.attrs['ties'] = [df['Gruppenname'].iloc[i] for i in result.ties]
+    return seats
 
 
-def calculate_seats() -> pd.DataFrame:
+def seats_from_totals(total_by_party, district_winners) -> pd.DataFrame:
     """
-    Calculate the seats for each party based on the votes and the seats in the Bundestag
+    Calculate the seats from the national second votes per party
+    (columns Gruppenname, Anzahl) and the winner of each district
     """
-    votes = get_second_votes()
-    # Calculate total votes and percentages for all of Germany
-    total_by_party = votes.groupby('Gruppenname')['Anzahl'].sum().astype(int).reset_index()
     total_by_party = combine_cdu_csu(total_by_party)
-    total_by_party = five_percent_rule(total_by_party)
+    total_by_party = five_percent_rule(total_by_party, district_winners)
 
     # $4.1 Von der Gesamtzahl der Sitze wird die Zahl der nach § 6
     # Absatz 2 erfolgreichen Wahlkreisbewerber abgezogen.    
-    seats_in_bundestag = 630 - n_independent_mandates()
+    seats_in_bundestag = 630 - n_independent_mandates(district_winners)
 
     # distribute the seats
     seats = allocate_seats(total_by_party, seats_in_bundestag)
 
     return seats
 
+
+@timed()
+def calculate_seats() -> pd.DataFrame:
+    """
+    Calculate the seats for each party based on the votes and the seats in the Bundestag
+    """
+    # The election state is kept up to date incrementally when a new
+    # snapshot arrives, see utils/snapshots.py
+    from utils.snapshots import get_election_state
+    return get_election_state().seats.copy()
+
+
+
+class SeatDistribution(NamedTuple):
+    # Seats per Gruppenname (rows) and Land (columns)
+    seats: pd.DataFrame
+    # Wahlkreis winners of all parties with their Land, Erststimmen share
+    # (Anteil, in percent) and whether their seat is covered (Mandat)
+    winners: pd.DataFrame
+
+    @property
+    def uncovered(self):
+        """Wahlkreis winners left without a seat"""
+        return self.winners[~self.winners['Mandat']]
+
+
+def distribute_seats(first_matrix, second_matrix, district_winners) -> SeatDistribution:
+    """
+    Full seat allocation of the BWG 2023 from the vote matrices of both
+    Stimmen and the district winners (see matrix.find_winners).
+
+    Unlike calculate_seats, CDU and CSU are separate parties here, as in
+    the law.
+    """
+    # § 4 Oberverteilung: seats per party over the national second votes
+    total_by_party = pd.DataFrame({
+        'Gruppenname': second_matrix.parties,
+        'Anzahl': second_matrix.values.sum(axis=0)
+    })
+    total_by_party = five_percent_rule(total_by_party[total_by_party['Anzahl'] > 0], district_winners)
+    # § 6 Abs. 2 covers only the Einzelbewerber. The SSW has Landeslisten,
+    # its Wahlkreis winners get its Land seats like those of any party.
+    elected_directly = district_winners['winner'].str.startswith('EB:')
+    seats_in_bundestag = 630 - int(elected_directly.sum())
+    party_seats = allocate_seats(total_by_party, seats_in_bundestag)
+
+    # § 5 Unterverteilung: each party's seats to its Landeslisten, all
+    # parties in one batch. The index of total_by_party is the column of
+    # the party in the matrix.
+    land_votes = land_totals(second_matrix)[:, total_by_party.index].T
+    land_seats = sainte_lague_batch(land_votes, party_seats['Sitze'].to_numpy())
+    seats = pd.DataFrame(
+        land_seats,
+        index=pd.Index(party_seats['Gruppenname'], name='Gruppenname'),
+        columns=pd.Index(list(LAENDER.values()), name='Land')
+    )
+
+    # § 6 Zweitstimmendeckung: in each Land, the party's Wahlkreis winners
+    # get its seats in the order of their Erststimmen share
+    values = first_matrix.values
+    valid = values.sum(axis=1)
+    winners = pd.DataFrame({
+        'Gebietsnummer': first_matrix.districts,
+        'Gruppenname': district_winners['winner'].reindex(first_matrix.districts).to_numpy(),
+        'Land': np.array(list(LAENDER.values()))[first_matrix.lands - 1],
+        'Anteil': values.max(axis=1) / np.where(valid > 0, valid, 1) * 100,
+    })
+    winners = winners[(winners['Gruppenname'] != '') & ~winners['Gruppenname'].str.startswith('EB:')]
+    winners = winners.sort_values('Anteil', ascending=False, kind='stable')
+    rank = winners.groupby(['Gruppenname', 'Land']).cumcount()
+    available = seats.stack().reindex(pd.MultiIndex.from_frame(winners[['Gruppenname', 'Land']]), fill_value=0)
+    winners['Mandat'] = rank.to_numpy() < available.to_numpy()
+
+    return SeatDistribution(seats, winners.sort_values('Gebietsnummer').reset_index(drop=True))
+
+
+@timed()
+def calculate_seat_distribution(snapshot=None) -> SeatDistribution:
+    """
+    Seats per party and Land and the Wahlkreis winners without a seat
+    (shared, do not modify)
+    """
+    snapshot = snapshot or newest_snapshot()
+    return _calculate_seat_distribution(snapshot, snapshot_version(snapshot))
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+@cache_miss('calculate_seat_distribution')
+def _calculate_seat_distribution(snapshot, version):
+    distribution = distribute_seats(get_vote_matrix(1, snapshot), get_vote_matrix(2, snapshot),
+                                    get_district_winners(snapshot))
+    return SeatDistribution(read_only(distribution.seats), read_only(distribution.winners))
+
+
 if __name__ == "__main__":
     seats = calculate_seats()
     print(seats)
\ No newline at end of file
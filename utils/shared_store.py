@@ -0,0 +1,280 @@
+# Snapshot data shared by the app processes of a host
+#
+# With several app processes behind a load balancer, each one used to read
+# every snapshot and keep its own copy of the frames derived from it. A
+# single loader process (python -m utils.shared_store) builds the election
+# state of every new snapshot, writes its frames as uncompressed Arrow IPC
+# files into a new generation directory and then points the generation
+# counter (GENERATION in the shared directory) at it with an atomic rename.
+#
+# App processes started with SHARED_STORE=<directory> memory map the files
+# of the current generation read-only and build the frames on the mapped
+# buffers without copying them, so the pages are in the page cache once no
+# matter how many processes map them. Processes switch to the next
+# generation on their next call after the rename, and keep reading the
+# snapshots themselves as long as there is none.
+#
+# Only the election state (long vote frames, district winners, totals,
+# seats) and the sorted votes of the DistrictIndex are shared. The geometry,
+# the seat distribution per Land, the rollup tables, the vote matrices and
+# the swing are still derived in every process from the shared frames.
+#
+#     python -m utils.shared_store --dir results/shared
+#     SHARED_STORE=results/shared streamlit run app.py
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import streamlit as st
+
+from utils.store import RESULTS_DIR, RETAINED_SNAPSHOTS, SnapshotVersion
+
+# Shared directory the app processes read from, unset to read the
+# snapshots in every process
+SHARED_DIR = os.environ.get('SHARED_STORE') or None
+DEFAULT_DIR = os.path.join(RESULTS_DIR, 'shared')
+GENERATION = 'GENERATION'
+# Seconds between the loader's checks for a new snapshot
+REFRESH_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+
+class Generation(NamedTuple):
+    number: int
+    # Directory with the frames of the generation
+    path: str
+    # File name of the kerg2 snapshot and its version
+    snapshot: str
+    version: SnapshotVersion
+
+
+# Frames and series are stored column by column, with what is needed to
+# rebuild them in the schema metadata. Categoricals are stored as their
+# codes, nullable integers as values and a mask, booleans as bytes, so all
+# of them map to NumPy arrays without a copy. Only the strings, object
+# columns and the categories, are converted on reading.
+
+def _encode(values):
+    # Arrow arrays and the description of one column
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return [pa.array(values.codes)], {'kind': 'category', 'categories': dtype.categories.tolist(),
+                                          'ordered': bool(dtype.ordered)}
+    if isinstance(values, (pd.arrays.IntegerArray, pd.arrays.FloatingArray)):
+        mask = pd.isna(values)
+        data = values.to_numpy(dtype=dtype.numpy_dtype, na_value=0)
+        return [pa.array(data), pa.array(mask.view(np.uint8))], {'kind': 'masked', 'dtype': str(dtype)}
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return [pa.array(values.view(np.uint8))], {'kind': 'bool'}
+    if values.dtype == object:
+        return [pa.array(values, type=pa.string(), from_pandas=True)], {'kind': 'object'}
+    return [pa.array(values)], {'kind': 'numpy'}
+
+
+def _interned(values):
+    # The frames repeat the same names and labels, every process keeps one
+    # copy of each string
+    return [sys.intern(value) if isinstance(value, str) else value for value in values]
+
+
+def _decode(description, arrays):
+    kind = description['kind']
+    if kind == 'object':
+        values = np.array(_interned(next(arrays).to_pylist()), dtype=object)
+        values.setflags(write=False)
+        return values
+    data = next(arrays).to_numpy(zero_copy_only=True)
+    if kind == 'category':
+        dtype = pd.CategoricalDtype(_interned(description['categories']), description['ordered'])
+        return pd.Categorical.from_codes(data, dtype=dtype, validate=False)
+    if kind == 'masked':
+        mask = next(arrays).to_numpy(zero_copy_only=True).view(bool)
+        return pd.api.types.pandas_dtype(description['dtype']).construct_array_type()(data, mask, copy=False)
+    if kind == 'bool':
+        return data.view(bool)
+    return data
+
+
+def write_frame(frame, path):
+    """Write a frame or series for read_frame, through a temporary file"""
+    series = isinstance(frame, pd.Series)
+    columns = frame.to_frame(name=frame.name) if series else frame
+    index = frame.index
+    default_index = isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1
+
+    arrays, layout = [], {'length': len(frame), 'columns': [], 'index': None}
+    for name, values in [(name, columns[name].array) for name in columns.columns] + \
+            ([] if default_index else [(index.name, index.array)]):
+        encoded, description = _encode(values)
+        arrays += encoded
+        layout['columns'].append({'name': name, **description})
+    if not default_index:
+        layout['index'] = layout['columns'].pop()
+    if series:
+        layout['series'] = True
+
+    batch = pa.RecordBatch.from_arrays(arrays, names=[f'f{i}' for i in range(len(arrays))],
+                                       metadata={'layout': json.dumps(layout)})
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+    os.replace(tmp_path, path)
+
+
+def read_frame(path):
+    """Memory map a frame written by write_frame, read-only and without copying the numeric columns"""
+    reader = ipc.open_file(pa.memory_map(path))
+    batch = reader.get_batch(0)
+    layout = json.loads(batch.schema.metadata[b'layout'])
+    arrays = iter(batch.columns)
+
+    columns = {description['name']: _decode(description, arrays) for description in layout['columns']}
+    if layout['index'] is None:
+        index = pd.RangeIndex(layout['length'])
+    else:
+        index = pd.Index(_decode(layout['index'], arrays), name=layout['index']['name'], copy=False)
+    frame = pd.DataFrame(columns, index=index, copy=False)
+    return frame.iloc[:, 0] if layout.get('series') else frame
+
+
+# (path, inode, mtime) of GENERATION -> Generation, so it is only parsed when it changed
+_generations = {}
+
+
+def current_generation(shared_dir=SHARED_DIR):
+    """The generation the loader published last, None if there is none or no shared directory"""
+    if shared_dir is None:
+        return None
+    path = os.path.join(shared_dir, GENERATION)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    signature = (path, stat.st_ino, stat.st_mtime_ns)
+    generation = _generations.get(signature)
+    if generation is None:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        generation = Generation(data['generation'], os.path.join(shared_dir, data['path']), data['snapshot'],
+                                SnapshotVersion(data['number'], data['sha256']))
+        _generations.clear()
+        _generations[signature] = generation
+    return generation
+
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+def attach(generation):
+    """Frames of a generation by name, memory mapped (shared, do not modify).
+
+    Cached on the whole Generation, so a directory that holds another
+    snapshot or version than before is mapped again.
+    """
+    return {name.removesuffix('.arrow'): read_frame(os.path.join(generation.path, name))
+            for name in os.listdir(generation.path) if name.endswith('.arrow')}
+
+
+def shared_frame(name, snapshot, version):
+    """Frame name of a snapshot from the current generation (shared, do not modify).
+
+    None if the generation holds another snapshot or version, the caller
+    then reads the snapshot itself.
+    """
+    generation = current_generation()
+    if generation is None or generation.snapshot != os.path.basename(snapshot) or generation.version != version:
+        return None
+    return attach(generation)[name]
+
+
+def publish_state(state, shared_dir=DEFAULT_DIR):
+    """Write the frames of an election state as the next generation, returns it"""
+    from utils.district_index import get_district_index
+
+    district_first, district_second = get_district_index(state.snapshot).sorted_votes
+    frames = {
+        'first_votes': state.first_votes,
+        'second_votes': state.second_votes,
+        'district_winners': state.district_winners,
+        'totals': state.totals,
+        'seats': state.seats,
+        'changed_districts': pd.Series(state.changed_districts, dtype=np.int16),
+        # Sorted and labelled like the DistrictIndex keeps them
+        'district_first': district_first,
+        'district_second': district_second,
+    }
+
+    previous = current_generation(shared_dir)
+    number = 1 if previous is None else previous.number + 1
+    name = f'{number:06d}'
+    path = os.path.join(shared_dir, name)
+    # The directory is complete before it is renamed into place
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    os.makedirs(tmp_path)
+    for frame_name, frame in frames.items():
+        write_frame(frame, os.path.join(tmp_path, f'{frame_name}.arrow'))
+    # Left over if a loader stopped before switching to it
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    # Switch the app processes over in one rename
+    target = os.path.join(shared_dir, GENERATION)
+    tmp = f'{target}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({
+            'generation': number,
+            'path': name,
+            'snapshot': os.path.basename(state.snapshot),
+            'number': state.version.number,
+            'sha256': state.version.sha256,
+        }, f)
+    os.replace(tmp, target)
+
+    # Processes still on an older generation keep their mapping of deleted
+    # files, only generations beyond the retained ones are removed
+    for old in os.listdir(shared_dir):
+        if old.isdigit() and int(old) <= number - RETAINED_SNAPSHOTS:
+            shutil.rmtree(os.path.join(shared_dir, old), ignore_errors=True)
+    return current_generation(shared_dir)
+
+
+def run_loader(shared_dir=DEFAULT_DIR, interval=REFRESH_INTERVAL):
+    """Publish a generation for every new snapshot, until interrupted"""
+    from utils.snapshots import get_election_state
+
+    os.makedirs(shared_dir, exist_ok=True)
+    published = current_generation(shared_dir)
+    while True:
+        # The state of a new snapshot is built in the background, the
+        # previous one is returned until it is ready
+        state = get_election_state()
+        if published is None or (published.snapshot, published.version) != \
+                (os.path.basename(state.snapshot), state.version):
+            published = publish_state(state, shared_dir)
+            logger.info("generation %d: %s", published.number, published.snapshot)
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the data of every new snapshot into the shared directory")
+    parser.add_argument('--dir', default=DEFAULT_DIR)
+    parser.add_argument('--interval', type=float, default=REFRESH_INTERVAL, help="seconds between snapshot checks")
+    args = parser.parse_args()
+    if SHARED_DIR is not None:
+        parser.error("the loader reads the snapshots itself, run it without SHARED_STORE")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    from streamlit.logger import set_log_level
+    set_log_level('error')
+    run_loader(args.dir, args.interval)
@@ -0,0 +1,207 @@
+# Monte Carlo seat simulation while the count is incomplete
+#
+# The districts that have not reported yet are filled with the vote shares
+# of the counted districts in their Land, and perturbed with random swings.
+# All draws go through the 5% rule, the Grundmandat exemption and the
+# Sainte-Laguë allocation as NumPy arrays, so 100k draws take seconds
+# instead of calling calculate_seats 100k times.
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.data_loader import get_first_votes, get_second_votes, get_vote_matrix
+from utils.matrix import land_totals
+from utils.seats import sainte_lague_batch
+from utils.store import RETAINED_SNAPSHOTS, newest_snapshot, snapshot_version
+
+# Draws per chunk, keeps the (draws x districts x parties) arrays small
+CHUNK_SIZE = 2000
+
+# Only parties with at least this share of the first votes in some Land can
+# win an uncounted district in the simulation
+MIN_LAND_SHARE = 0.03
+
+# In an uncounted district, candidates further behind the leader than this
+# many sigma (in log votes) can not catch up and are not simulated
+MAX_GAP_SIGMAS = 12
+
+
+def land_presence(matrix, votes):
+    """(16 x parties) mask of the parties of a VoteMatrix that are on the
+    ballot in a Land, from the rows of votes (counted or not)"""
+    cols = pd.Categorical(votes['Gruppenname'], categories=matrix.parties).codes
+    known = cols >= 0
+    present = np.zeros((16, len(matrix.parties)), dtype=bool)
+    present[votes['UegGebietsnummer'].to_numpy()[known] - 1, cols[known]] = True
+    return present
+
+
+def _expected_votes(matrix, present):
+    """Expected votes of every district, the counted districts as they are
+    and the uncounted ones with the average share of the counted districts
+    in their Land. If nothing in the Land is counted yet, the national
+    shares of the parties on the ballot there (present, see land_presence)
+    are used, so e.g. the CSU gets no votes outside Bavaria."""
+    values = matrix.values.astype(np.float64)
+    counted = values.sum(axis=1) > 0
+    if not counted.any():
+        raise ValueError("Es liegen noch keine Ergebnisse vor")
+
+    national = values[counted].sum(axis=0)
+    fallback = national / national.sum() * present
+    fallback_sum = fallback.sum(axis=1, keepdims=True)
+    fallback = fallback / np.where(fallback_sum > 0, fallback_sum, 1)
+    land_votes = land_totals(matrix).astype(np.float64)
+    land_sum = land_votes.sum(axis=1, keepdims=True)
+    land_shares = np.where(land_sum > 0, land_votes / np.where(land_sum > 0, land_sum, 1), fallback)
+
+    mean_valid = values[counted].sum(axis=1).mean()
+    expected = values.copy()
+    expected[~counted] = land_shares[matrix.lands[~counted] - 1] * mean_valid
+    return expected, counted
+
+
+def _simulate_chunk(args):
+    (n_draws, seed, sigma, second_fixed, second_open, log_first_open, first_cols, first_cols_in_second,
+     fixed_wins, fixed_independent, independent_cols, ssw_col, total_seats) = args
+    rng = np.random.default_rng(seed)
+    n_parties = len(second_fixed)
+
+    # National swing per party, shared by both Stimmen of the same party
+    swing = rng.standard_normal((n_draws, n_parties), dtype=np.float32) * sigma
+
+    # Second votes: only the uncounted part of the national totals moves
+    second = second_fixed + second_open * np.exp(swing - sigma ** 2 / 2)
+
+    # First votes: national swing plus district noise in uncounted districts
+    wins = np.tile(fixed_wins, (n_draws, 1))
+    independent = np.full(n_draws, fixed_independent)
+    if log_first_open.shape[0]:
+        # log_first_open holds the viable candidates of each uncounted
+        # district, first_cols their column in the first vote matrix
+        swing_cols = first_cols_in_second[first_cols]
+        first = rng.standard_normal((n_draws,) + log_first_open.shape, dtype=np.float32)
+        first *= sigma
+        first += log_first_open
+        first += np.where(swing_cols >= 0, swing[:, swing_cols], 0)
+        winner = first_cols[np.arange(first_cols.shape[0]), first.argmax(axis=2)]
+        n_cols = len(first_cols_in_second)
+        won = np.bincount((winner + np.arange(n_draws)[:, None] * n_cols).ravel(),
+                          minlength=n_draws * n_cols).reshape(n_draws, n_cols)
+        in_second = first_cols_in_second >= 0
+        wins[:, first_cols_in_second[in_second]] += won[:, in_second]
+        independent += won[:, independent_cols].sum(axis=1)
+
+    # 5% rule with the exemptions for national minorities and 3 Grundmandate
+    above_threshold = second > 0.05 * second.sum(axis=1, keepdims=True)
+    passed = above_threshold | (wins >= 3)
+    if ssw_col >= 0:
+        # Exempt, but only with votes to get seats for
+        passed[:, ssw_col] = second[:, ssw_col] > 0
+
+    seats = sainte_lague_batch(np.where(passed, second, 0), total_seats - independent)
+    return seats, above_threshold, passed
+
+
+def simulate_seats(n_draws=10000, sigma=0.1, seed=None, workers=None, snapshot=None):
+    """
+    Seat distribution over n_draws perturbed versions of the current count.
+
+    sigma is the relative uncertainty of a party's vote share in a district
+    that has not reported yet. Because counted districts stay fixed, the
+    spread shrinks with the share of uncounted districts. Pass workers to
+    spread the draws over a process pool.
+
+    Returns a frame per party with the mean seats, the 5%/50%/95% quantiles,
+    the probability of more than 5% of the second votes and the probability
+    of entering the Bundestag. CDU and CSU are separate parties, as in
+    seats.distribute_seats.
+    """
+    first_matrix = get_vote_matrix(1, snapshot)
+    second_matrix = get_vote_matrix(2, snapshot)
+
+    second_expected, second_counted = _expected_votes(
+        second_matrix, land_presence(second_matrix, get_second_votes(snapshot)))
+    first_expected, first_counted = _expected_votes(
+        first_matrix, land_presence(first_matrix, get_first_votes(snapshot)))
+    second_fixed = second_expected[second_counted].sum(axis=0)
+    second_open = second_expected[~second_counted].sum(axis=0)
+
+    # Winners of the counted districts are fixed
+    parties = second_matrix.parties
+    party_index = second_matrix.party_index
+    first_cols_in_second = np.array([party_index.get(p, -1) for p in first_matrix.parties])
+    independent_cols = np.array([p.startswith('EB:') for p in first_matrix.parties])
+    counted_winner = first_expected[first_counted].argmax(axis=1)
+    fixed_wins = np.zeros(len(parties), dtype=np.int64)
+    in_second = first_cols_in_second[counted_winner]
+    np.add.at(fixed_wins, in_second[in_second >= 0], 1)
+    fixed_independent = int(independent_cols[counted_winner].sum())
+
+    # Candidates that can win an uncounted district: strong enough in some
+    # Land and not too far behind the leader of the district
+    land_votes = land_totals(first_matrix)
+    land_shares = land_votes / np.maximum(land_votes.sum(axis=1, keepdims=True), 1)
+    open_votes = first_expected[~first_counted] * (land_shares.max(axis=0) >= MIN_LAND_SHARE)
+    # The chunks compare log votes, which saves an exp over the whole array
+    with np.errstate(divide='ignore'):
+        log_open = np.log(open_votes)
+    order = np.argsort(-log_open, axis=1)
+    log_open = np.take_along_axis(log_open, order, axis=1)
+    viable = log_open >= log_open[:, :1] - MAX_GAP_SIGMAS * sigma
+    n_viable = viable.sum(axis=1).max() if len(viable) else 0
+    first_cols = order[:, :n_viable]
+    log_first_open = np.where(viable, log_open, -np.inf)[:, :n_viable].astype(np.float32)
+
+    base = (second_fixed, second_open.astype(np.float32), log_first_open, first_cols, first_cols_in_second,
+            fixed_wins, fixed_independent, independent_cols, party_index.get('SSW', -1), 630)
+    seeds = np.random.SeedSequence(seed).spawn((n_draws + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    chunks = [(min(CHUNK_SIZE, n_draws - i * CHUNK_SIZE), s, sigma) + base for i, s in enumerate(seeds)]
+
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_simulate_chunk, chunks))
+    else:
+        results = [_simulate_chunk(chunk) for chunk in chunks]
+
+    seats = np.concatenate([r[0] for r in results])
+    above_threshold = np.concatenate([r[1] for r in results])
+    passed = np.concatenate([r[2] for r in results])
+
+    result = pd.DataFrame({
+        'Mittel': seats.mean(axis=0),
+        'Q05': np.quantile(seats, 0.05, axis=0),
+        'Median': np.quantile(seats, 0.5, axis=0),
+        'Q95': np.quantile(seats, 0.95, axis=0),
+        'P_5_Prozent': above_threshold.mean(axis=0),
+        'P_Bundestag': passed.mean(axis=0),
+    }, index=pd.Index(parties, name='Gruppenname'))
+    result.attrs['uncounted_share'] = 1 - first_counted.mean()
+    return result[result['P_Bundestag'] > 0].sort_values('Mittel', ascending=False)
+
+
+
+def get_seat_simulation(n_draws=10000, snapshot=None):
+    """Cached simulate_seats with a fixed seed, for the app"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_seat_simulation(n_draws, snapshot, snapshot_version(snapshot))
+
+@st.cache_data(max_entries=RETAINED_SNAPSHOTS)
+def _get_seat_simulation(n_draws, snapshot, version):
+    return simulate_seats(n_draws, seed=0, snapshot=snapshot)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo seat simulation")
+    parser.add_argument('--draws', type=int, default=10000)
+    parser.add_argument('--sigma', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--snapshot', default=None, help="kerg2 file, default is the newest")
+    args = parser.parse_args()
+    print(simulate_seats(args.draws, args.sigma, args.seed, args.workers, args.snapshot))
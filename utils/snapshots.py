@@ -0,0 +1,227 @@
+# Incremental recomputation when a new kerg2 snapshot arrives
+#
+# On election night consecutive snapshots only differ in a few Wahlkreise.
+# Instead of recomputing winners, national totals and seats from scratch,
+# the snapshots are diffed and the derived state is only updated for the
+# districts and parties that changed.
+
+import os
+import threading
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.data_loader import get_district_winners, get_first_votes, get_second_votes, get_vote_matrix
+from utils.figure_cache import forget_snapshots
+from utils.matrix import find_winners
+from utils.rollup import get_rollup
+from utils.seats import seats_from_totals
+from utils.shared_store import attach, current_generation
+from utils.store import RESULTS_DIR, RETAINED_SNAPSHOTS, SnapshotVersion, read_only, snapshot_files, \
+    snapshot_version
+
+KEYS = ['Gebietsnummer', 'Gruppenname', 'Stimme']
+
+
+@dataclass
+class ElectionState:
+    """Results of one snapshot and everything derived from them"""
+    snapshot: str
+    first_votes: pd.DataFrame
+    second_votes: pd.DataFrame
+    # Winner per Gebietsnummer, see matrix.find_winners
+    district_winners: pd.DataFrame
+    # National second votes per Gruppenname
+    totals: pd.Series
+    seats: pd.DataFrame
+    # Districts that changed compared to the previous snapshot
+    changed_districts: list = field(default_factory=list)
+    # Sequence number and content hash, see store.snapshot_version
+    version: SnapshotVersion = None
+
+    @property
+    def key(self):
+        """(snapshot, version), the figures of the state are cached under it"""
+        return self.snapshot, self.version
+
+
+def diff_votes(old_votes, new_votes):
+    """Changed (Gebietsnummer, Gruppenname, Stimme) cells between two vote frames.
+
+    Returns a frame with the keys and the columns Anzahl_alt and Anzahl_neu.
+    Cells without results are compared as missing, so a district that
+    reports for the first time shows up as changed.
+    """
+    merged = pd.merge(
+        old_votes[KEYS + ['Anzahl']], new_votes[KEYS + ['Anzahl']],
+        on=KEYS, how='outer', suffixes=('_alt', '_neu')
+    )
+    unchanged = (merged['Anzahl_alt'] == merged['Anzahl_neu']).fillna(False) | (
+        merged['Anzahl_alt'].isna() & merged['Anzahl_neu'].isna()
+    )
+    return merged[~unchanged].reset_index(drop=True)
+
+
+def diff_snapshots(old_snapshot, new_snapshot):
+    """Changed cells between two kerg2 snapshot files"""
+    old_votes = pd.concat([get_first_votes(old_snapshot), get_second_votes(old_snapshot)])
+    new_votes = pd.concat([get_first_votes(new_snapshot), get_second_votes(new_snapshot)])
+    return diff_votes(old_votes, new_votes)
+
+
+def _seats(totals, district_winners):
+    total_by_party = totals.rename('Anzahl').rename_axis('Gruppenname').reset_index()
+    return read_only(seats_from_totals(total_by_party, district_winners))
+
+
+def build_state(snapshot):
+    """Compute the election state of a snapshot from scratch"""
+    first_votes = get_first_votes(snapshot)
+    second_votes = get_second_votes(snapshot)
+    district_winners = get_district_winners(snapshot)
+    # National totals from the rollup instead of summing all districts
+    totals = read_only(get_rollup(snapshot).national(2))
+    return ElectionState(
+        snapshot=snapshot,
+        first_votes=first_votes,
+        second_votes=second_votes,
+        district_winners=district_winners,
+        totals=totals,
+        seats=_seats(totals, district_winners),
+        version=snapshot_version(snapshot),
+    )
+
+
+def update_state(state, snapshot):
+    """Bring an election state to a newer snapshot.
+
+    Only the districts with changed first votes get a new winner, and the
+    national totals are updated by the second vote differences.
+    """
+    first_votes = get_first_votes(snapshot)
+    second_votes = get_second_votes(snapshot)
+
+    changes = pd.concat([
+        diff_votes(state.first_votes, first_votes),
+        diff_votes(state.second_votes, second_votes),
+    ], ignore_index=True)
+    changed_districts = sorted(changes['Gebietsnummer'].unique().tolist())
+    if changes.empty:
+        return ElectionState(snapshot, first_votes, second_votes, state.district_winners,
+                             state.totals, state.seats, changed_districts, snapshot_version(snapshot))
+
+    # District winners, only for districts with changed first votes
+    district_winners = state.district_winners
+    first_changes = changes[changes['Stimme'] == 1]
+    if not first_changes.empty:
+        matrix = get_vote_matrix(1, snapshot)
+        rows = np.flatnonzero(np.isin(matrix.districts, first_changes['Gebietsnummer'].unique()))
+        updated = find_winners(matrix, rows)
+        district_winners = read_only(pd.concat([
+            district_winners.drop(updated.index, errors='ignore'), updated
+        ]).sort_index())
+
+    # National totals, only for parties with changed second votes
+    totals = state.totals
+    second_changes = changes[changes['Stimme'] == 2]
+    if not second_changes.empty:
+        delta = second_changes.assign(
+            delta=second_changes['Anzahl_neu'].fillna(0) - second_changes['Anzahl_alt'].fillna(0)
+        ).groupby('Gruppenname', observed=True)['delta'].sum().astype(int)
+        totals = read_only(totals.add(delta, fill_value=0).astype(int))
+
+    return ElectionState(
+        snapshot=snapshot,
+        first_votes=first_votes,
+        second_votes=second_votes,
+        district_winners=district_winners,
+        totals=totals,
+        seats=_seats(totals, district_winners),
+        changed_districts=changed_districts,
+        version=snapshot_version(snapshot),
+    )
+
+
+@st.cache_resource
+def _state_holder():
+    # Shared by all sessions of this process
+    return {'state': None, 'lock': threading.Lock(), 'building': None}
+
+
+def _evict_superseded(files, old_state):
+    # Figures of snapshots beyond the retained ones, and of the old version
+    # of a snapshot that was rewritten, are dropped. The data caches evict
+    # on their own (max_entries=RETAINED_SNAPSHOTS).
+    stale_versions = set()
+    if old_state is not None and old_state.snapshot in files[-RETAINED_SNAPSHOTS:]:
+        if snapshot_version(old_state.snapshot) != old_state.version:
+            stale_versions.add(old_state.key)
+    forget_snapshots(set(files[:-RETAINED_SNAPSHOTS]), stale_versions)
+
+
+def _advance(holder, state, snapshot):
+    # Runs in a background thread, the sessions keep getting the old state
+    try:
+        new_state = update_state(state, snapshot)
+        with holder['lock']:
+            holder['state'] = new_state
+        _evict_superseded(snapshot_files(), state)
+    finally:
+        holder['building'] = None
+
+
+@st.cache_resource(max_entries=RETAINED_SNAPSHOTS)
+def _shared_state(generation):
+    # Election state of a generation of the shared store
+    frames = attach(generation)
+    return ElectionState(
+        snapshot=os.path.join(RESULTS_DIR, generation.snapshot),
+        first_votes=frames['first_votes'],
+        second_votes=frames['second_votes'],
+        district_winners=frames['district_winners'],
+        totals=frames['totals'],
+        seats=frames['seats'],
+        changed_districts=frames['changed_districts'].tolist(),
+        version=generation.version,
+    )
+
+
+def get_election_state():
+    """Election state of the newest snapshot, updated incrementally.
+
+    When a new snapshot arrives, the state is updated in a background
+    thread and the previous state is returned until it is done. Only the
+    very first call waits for a state to be built. With a shared store
+    (see utils/shared_store.py) it is the state of the current generation.
+    """
+    holder = _state_holder()
+    generation = current_generation()
+    if generation is not None:
+        state = _shared_state(generation)
+        with holder['lock']:
+            previous, holder['state'] = holder['state'], state
+        if previous is not None and previous is not state:
+            _evict_superseded(snapshot_files(), previous)
+        return state
+
+    files = snapshot_files()
+    snapshot = files[-1]
+    with holder['lock']:
+        state = holder['state']
+        if state is None and len(files) > 1:
+            # Start from the previous snapshot so the changed districts are known
+            state = holder['state'] = update_state(build_state(files[-2]), snapshot)
+        elif state is None:
+            state = holder['state'] = build_state(snapshot)
+        elif (state.snapshot, state.version) != (snapshot, snapshot_version(snapshot)) and holder['building'] is None:
+            holder['building'] = threading.Thread(target=_advance, args=(holder, state, snapshot),
+                                                  name=f'election-state-{snapshot}', daemon=True)
+            holder['building'].start()
+    return state
+
+
+def get_changed_districts():
+    """Districts that changed with the newest snapshot"""
+    return get_election_state().changed_districts
@@ -0,0 +1,220 @@
+# Static build of the dashboard
+#
+# Renders the overview, the map and one page per Wahlkreis as static HTML
+# (plus the data as JSON) that a CDN can serve without the Streamlit
+# server. The figures come from the same functions the components use. The
+# district pages are rendered in a process pool, and a manifest with a hash
+# of every page's data makes later builds only rewrite what changed.
+
+import argparse
+import hashlib
+import html
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.io as pio
+from plotly.offline import get_plotlyjs_version
+
+from components.direct_candidates_vs_seats import create_direct_vs_total_figure
+from components.map import create_wahlkreis_map
+from components.overview import create_seats_figure, create_votes_figure
+from components.results import create_votes_plot
+from utils.data_loader import geojson_size, load_geojson, process_geojson
+from utils.district_index import get_district_index
+from utils.geometry import DEFAULT_LEVEL
+from utils.snapshots import get_election_state
+
+SITE_DIR = 'site'
+MANIFEST = 'manifest.json'
+
+# Bump when the page layout changes, so the next build rewrites all pages
+SITE_VERSION = 1
+
+PAGE = """<!DOCTYPE html>
+<html lang="de">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<script src="https://cdn.plot.ly/plotly-{plotly_version}.min.js"></script>
+<style>
+body {{ font-family: sans-serif; margin: 0 auto; max-width: 1400px; padding: 1rem; }}
+.row {{ display: flex; flex-wrap: wrap; gap: 1rem; }}
+.row > div {{ flex: 1 1 600px; min-width: 0; }}
+</style>
+</head>
+<body>
+{body}
+<p><small>Stand: {snapshot} &middot; Wahldaten: &copy; Die Bundeswahlleiterin, Statistisches Bundesamt, 65180 Wiesbaden</small></p>
+</body>
+</html>
+"""
+
+# Opens the page of the clicked district
+MAP_CLICK = """document.getElementById('{plot_id}').on('plotly_click', function(data) {
+    window.location.href = 'wahlkreis/' + data.points[0].location + '.html';
+});"""
+
+
+def _figure_html(fig, post_script=None):
+    return pio.to_html(fig, full_html=False, include_plotlyjs=False, post_script=post_script,
+                       config={'displaylogo': False})
+
+
+def _page(title, body, snapshot):
+    return PAGE.format(title=html.escape(title), body=body, snapshot=html.escape(os.path.basename(snapshot)),
+                       plotly_version=get_plotlyjs_version())
+
+
+def _records(votes):
+    # Anzahl is NaN while a district is being counted, JSON gets null
+    columns = [c for c in ['Gruppenname', 'label', 'Anzahl'] if c in votes.columns]
+    return json.loads(votes[columns].to_json(orient='records', force_ascii=False))
+
+
+def _write(path, content):
+    # Write next to the target and rename, so the CDN never serves half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def _hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def district_data(nr, result):
+    """Data of a district page, also written out as JSON"""
+    return {
+        'WKR_NR': nr,
+        'name': result.name,
+        'winner': result.winner,
+        'first_votes': _records(result.first_votes),
+        'second_votes': _records(result.second_votes),
+    }
+
+
+def render_district(args):
+    """Write the page and JSON of one Wahlkreis"""
+    out, snapshot, nr, result = args
+    sections = []
+    for vote_type, votes in [('Erststimmen', result.first_votes), ('Zweitstimmen', result.second_votes)]:
+        if votes.empty or votes['Anzahl'].sum() == 0:
+            sections.append(f"<div><p>{vote_type}: Die Stimmen werden noch ausgezählt.</p></div>")
+        else:
+            fig = create_votes_plot(votes, False, f'{vote_type} nach Partei (Top 8)')
+            sections.append(f"<div>{_figure_html(fig)}</div>")
+
+    title = f"Wahlkreis {nr}: {result.name}"
+    body = (f'<p><a href="../index.html">&larr; Übersicht</a></p>'
+            f'<h1>{html.escape(title)}</h1><p>Gewinner: {html.escape(result.winner)}</p>'
+            f'<div class="row">{"".join(sections)}</div>')
+    _write(os.path.join(out, 'wahlkreis', f'{nr}.html'), _page(title, body, snapshot))
+    _write(os.path.join(out, 'wahlkreis', f'{nr}.json'),
+           json.dumps(district_data(nr, result), ensure_ascii=False))
+    return nr
+
+
+def overview_data(state):
+    """Data of the overview page, also written out as JSON"""
+    seats = state.seats
+    return {
+        'snapshot': os.path.basename(state.snapshot),
+        'second_votes': {party: int(n) for party, n in state.totals.items()},
+        'seats': dict(zip(seats['Gruppenname'], seats['Sitze'].astype(int).tolist())),
+        'winners': {str(nr): label for nr, label in state.district_winners['label'].items()},
+    }
+
+
+def render_overview(out, state, map_level=DEFAULT_LEVEL):
+    """Write the overview page with the map and its JSON"""
+    geojson_data = load_geojson(map_level)
+    map_fig, _ = create_wahlkreis_map(process_geojson(geojson_data), geojson_data, geojson_size(map_level), state)
+
+    body = (
+        '<h1>Bundestagswahl 2025</h1><div class="row">'
+        f'<div><h2>Zweitstimmen bundesweit</h2>{_figure_html(create_votes_figure(False, state.snapshot))}</div>'
+        f'<div><h2>Sitzverteilung im Bundestag</h2>{_figure_html(create_seats_figure(state))}</div></div>'
+        '<h2>Wahlkreisergebnisse</h2><p>Klicken Sie auf einen Wahlkreis, um die Ergebnisse anzuzeigen.</p>'
+        f'{_figure_html(map_fig, MAP_CLICK)}'
+        '<h2>Vergleich: Direktmandate und Gesamtsitze</h2>'
+        f'{_figure_html(create_direct_vs_total_figure(state))}'
+    )
+    _write(os.path.join(out, 'index.html'), _page('Bundestagswahl 2025', body, state.snapshot))
+    _write(os.path.join(out, 'overview.json'), json.dumps(overview_data(state), ensure_ascii=False))
+
+
+def _read_manifest(out):
+    try:
+        with open(os.path.join(out, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return manifest if manifest.get('version') == SITE_VERSION else {}
+
+
+def build_site(out=SITE_DIR, workers=None, force=False, state=None):
+    """Build the site for an election state (default: the newest), rewriting only pages whose data changed.
+
+    Returns the WKR_NR of the rewritten district pages and whether the
+    overview was rewritten.
+    """
+    state = state or get_election_state()
+    index = get_district_index(state.snapshot)
+    manifest = {} if force else _read_manifest(out)
+    old_pages = manifest.get('districts', {})
+
+    hashes = {str(nr): _hash(district_data(nr, result)) for nr, result in index.items()}
+    changed = [nr for nr in index if old_pages.get(str(nr)) != hashes[str(nr)]
+               or not os.path.exists(os.path.join(out, 'wahlkreis', f'{nr}.html'))]
+
+    tasks = [(out, state.snapshot, nr, index[nr]) for nr in changed]
+    if workers and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(render_district, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+    else:
+        for task in tasks:
+            render_district(task)
+
+    overview_hash = _hash(overview_data(state))
+    overview_changed = manifest.get('overview') != overview_hash or not os.path.exists(os.path.join(out, 'index.html'))
+    if overview_changed:
+        render_overview(out, state)
+
+    _write(os.path.join(out, MANIFEST), json.dumps({
+        'version': SITE_VERSION,
+        'snapshot': os.path.basename(state.snapshot),
+        'overview': overview_hash,
+        'districts': hashes,
+    }, indent=1))
+    return changed, overview_changed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the dashboard as a static site")
+    parser.add_argument('--out', default=SITE_DIR)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true', help="rewrite all pages")
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                        help="keep running and rebuild when a new snapshot arrives")
+    args = parser.parse_args()
+
+    # Compared by number and hash, so a snapshot rewritten under the same
+    # name is built again
+    built = None
+    while True:
+        state = get_election_state()
+        if state.version != built:
+            start = time.perf_counter()
+            changed, overview_changed = build_site(args.out, args.workers, args.force, state)
+            args.force = False
+            built = state.version
+            print(f"{state.snapshot}: {len(changed)} Wahlkreise, Übersicht {'neu' if overview_changed else 'unverändert'} "
+                  f"({time.perf_counter() - start:.1f} s)")
+        if args.watch is None:
+            break
+        time.sleep(args.watch)
@@ -0,0 +1,195 @@
+# Columnar snapshot store for the kerg2 result files
+#
+# Each kerg2 CSV is converted once into an Arrow IPC file under results/store/
+# that only keeps the columns the app needs, with narrow types. Reading a
+# snapshot is then a memory map instead of a full CSV parse.
+
+import glob
+import hashlib
+import os
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.ipc as ipc
+
+RESULTS_DIR = 'results'
+STORE_DIR = os.path.join(RESULTS_DIR, 'store')
+
+# Number of snapshots whose data and figures are kept in the caches
+RETAINED_SNAPSHOTS = int(os.environ.get('RETAINED_SNAPSHOTS', 3))
+
+# Columns kept from the kerg2 files and their types on disk.
+# Strings are dictionary encoded, counts are nullable 32 bit integers
+# (uncounted districts have empty Anzahl cells).
+SCHEMA = pa.schema([
+    ('Gebietsart', pa.dictionary(pa.int8(), pa.string())),
+    ('Gebietsnummer', pa.int16()),
+    ('Gebietsname', pa.dictionary(pa.int16(), pa.string())),
+    ('UegGebietsnummer', pa.int8()),
+    ('Gruppenart', pa.dictionary(pa.int8(), pa.string())),
+    ('Gruppenname', pa.dictionary(pa.int16(), pa.string())),
+    ('Gruppenreihenfolge', pa.int16()),
+    ('Stimme', pa.int8()),
+    ('Anzahl', pa.int32()),
+    ('VorpAnzahl', pa.int32()),
+])
+
+
+def snapshot_number(path):
+    """Sequence number of a kerg2 file, e.g. 285 for kerg2_00285.csv"""
+    return int(os.path.basename(path).split('_')[1].split('.')[0])
+
+
+def snapshot_files(results_dir=RESULTS_DIR):
+    """All kerg2 snapshots in results/, oldest first"""
+    return sorted(glob.glob(os.path.join(results_dir, 'kerg2_*.csv')), key=snapshot_number)
+
+
+def newest_snapshot():
+    return snapshot_files()[-1]
+
+
+class SnapshotVersion(NamedTuple):
+    """Identity of a snapshot, a file rewritten under the same name gets a new one"""
+    number: int
+    sha256: str
+
+
+# (path, mtime, size) -> SnapshotVersion, so only changed files are hashed
+_versions = {}
+
+
+def snapshot_version(csv_path):
+    """Sequence number and content hash of a snapshot, one stat call if the file did not change"""
+    stat = os.stat(csv_path)
+    signature = (csv_path, stat.st_mtime_ns, stat.st_size)
+    version = _versions.get(signature)
+    if version is None:
+        with open(csv_path, 'rb') as f:
+            version = SnapshotVersion(snapshot_number(csv_path), hashlib.file_digest(f, 'sha256').hexdigest())
+        # Forget the older signatures of the file
+        for key in [key for key in _versions if key[0] == csv_path]:
+            _versions.pop(key, None)
+        _versions[signature] = version
+    return version
+
+
+def snapshot_time(csv_path):
+    """Time of a snapshot from the "Stand:" line of the preamble, NaT if it has none"""
+    with open(csv_path, encoding='utf-8-sig') as f:
+        for line, _ in zip(f, range(9)):
+            fields = line.split(';')
+            if fields[0] == 'Stand:':
+                return pd.to_datetime(f'{fields[1]} {fields[2]}', format='%d.%m.%Y %H:%M', errors='coerce')
+    return pd.NaT
+
+
+def store_path(csv_path):
+    # The store sits next to the CSV, so results/ maps to STORE_DIR
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(os.path.dirname(csv_path), 'store', f'{name}.arrow')
+
+
+def parse_snapshot(csv_path):
+    """Parse a kerg2 CSV into an Arrow table with the store schema"""
+    table = pv.read_csv(
+        csv_path,
+        read_options=pv.ReadOptions(skip_rows=9),
+        parse_options=pv.ParseOptions(delimiter=';'),
+        convert_options=pv.ConvertOptions(
+            include_columns=SCHEMA.names,
+            column_types={field.name: field.type for field in SCHEMA
+                          if not pa.types.is_dictionary(field.type)},
+        ),
+    )
+    return table.select(SCHEMA.names).combine_chunks().cast(SCHEMA)
+
+
+def ingest_snapshot(csv_path, force=False):
+    """Convert a kerg2 CSV into the store unless an up-to-date copy exists.
+
+    Returns the path of the Arrow file.
+    """
+    path = store_path(csv_path)
+    if not force and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = parse_snapshot(csv_path)
+    # Write to a temporary file first so readers never see a half written file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_snapshot(csv_path, gebietsart=None, stimme=None, gruppenart=None):
+    """Memory map a snapshot from the store and return the selected rows.
+
+    The filters are applied on the Arrow table, so only the matching rows
+    are converted to pandas. Strings come as categoricals with only the
+    categories of the selected rows, the counts as nullable Int32.
+    """
+    source = pa.memory_map(ingest_snapshot(csv_path))
+    table = ipc.open_file(source).read_all()
+
+    mask = None
+    if gebietsart is not None:
+        mask = _and(mask, pc.equal(table['Gebietsart'].cast(pa.string()), gebietsart))
+    if stimme is not None:
+        mask = _and(mask, pc.equal(table['Stimme'], stimme))
+    if gruppenart is not None:
+        mask = _and(mask, pc.is_in(table['Gruppenart'].cast(pa.string()), pa.array(gruppenart)))
+    if mask is not None:
+        table = table.filter(mask)
+
+    frame = table.to_pandas(types_mapper={pa.int32(): pd.Int32Dtype()}.get)
+    for column in frame.select_dtypes('category'):
+        frame[column] = frame[column].cat.remove_unused_categories()
+    return frame
+
+
+def _read_only_values(values):
+    # The values of a column in arrays marked read-only
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # .codes is a read-only view already
+        return pd.Categorical.from_codes(values.codes, dtype=values.dtype, validate=False)
+    if isinstance(values, (pd.arrays.IntegerArray, pd.arrays.FloatingArray, pd.arrays.BooleanArray)):
+        data = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+        mask = np.asarray(values.isna())
+        data.setflags(write=False)
+        mask.setflags(write=False)
+        return type(values)(data, mask)
+    array = np.array(values)
+    array.setflags(write=False)
+    return array
+
+
+def read_only(frame):
+    """A copy of a frame or series whose data can not be modified in place.
+
+    The frames of the data layer are shared by all sessions of a process,
+    writing into them (frame.loc[...] = ...) raises instead of changing
+    them for everyone. Anything derived from them is a new, writable frame.
+    """
+    if isinstance(frame, pd.Series):
+        return pd.Series(_read_only_values(frame.array), index=frame.index, name=frame.name, copy=False)
+    result = pd.DataFrame({i: _read_only_values(frame.iloc[:, i].array) for i in range(frame.shape[1])},
+                          index=frame.index, copy=False)
+    result.columns = frame.columns
+    return result
+
+
+def _and(mask, condition):
+    return condition if mask is None else pc.and_(mask, condition)
+
+
+if __name__ == "__main__":
+    for csv_path in snapshot_files():
+        print(ingest_snapshot(csv_path, force=True))
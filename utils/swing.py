@@ -0,0 +1,110 @@
+# Swing against the previous election
+#
+# Every kerg2 row also carries the result of the previous election on the
+# current district boundaries (VorpAnzahl). Both elections are turned into
+# district x party vote matrices with the same rows and columns, so shares,
+# swings, winner flips and a uniform swing projection are whole-matrix
+# NumPy operations, computed once per snapshot and Stimme.
+
+from dataclasses import dataclass, replace
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.data_loader import get_first_votes, get_second_votes
+from utils.matrix import build_vote_matrix, find_winners
+from utils.store import RETAINED_SNAPSHOTS, newest_snapshot, snapshot_version
+
+
+@dataclass(frozen=True)
+class SwingAnalysis:
+    """Shares and swings of one Stimme, (districts x parties) like a VoteMatrix"""
+    # Gebietsnummer of each row and Gruppenname of each column
+    districts: np.ndarray
+    parties: np.ndarray
+    # Shares of the valid votes in percent, NaN where a district has no
+    # results (yet) in that election
+    current: np.ndarray
+    previous: np.ndarray
+    # current - previous in percentage points
+    swing: np.ndarray
+    # Winners of both elections, see matrix.find_winners
+    winners: pd.DataFrame
+    previous_winners: pd.DataFrame
+    # National shares and swing over the districts counted in both elections
+    national: pd.DataFrame
+    # Winners if every district moved by the national swing
+    projected_winners: pd.DataFrame
+
+    def party_swing(self, party):
+        """Swing of one party per Gebietsnummer, NaN where a district is not counted in both elections"""
+        return pd.Series(self.swing[:, list(self.parties).index(party)],
+                         index=pd.Index(self.districts, name='Gebietsnummer'), name=party)
+
+    @property
+    def flips(self):
+        """Districts counted in both elections whose winner changed"""
+        counted = (self.winners['winner'] != '') & (self.previous_winners['winner'] != '')
+        changed = counted & (self.winners['winner'] != self.previous_winners['winner'])
+        return pd.DataFrame({
+            'previous': self.previous_winners.loc[changed, 'label'],
+            'current': self.winners.loc[changed, 'label'],
+        })
+
+
+def _shares(values):
+    totals = values.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(totals > 0, values / totals * 100, np.nan)
+
+
+def build_swing(votes):
+    """Build the SwingAnalysis from a frame like get_first_votes() or get_second_votes().
+
+    Shares are relative to the votes of the parties in the frame, parties
+    that only ran in the previous election are not part of the kerg2 files.
+    """
+    current = build_vote_matrix(votes)
+    previous = build_vote_matrix(votes.assign(Anzahl=votes['VorpAnzahl']))
+
+    current_shares = _shares(current.values)
+    previous_shares = _shares(previous.values)
+    swing = current_shares - previous_shares
+
+    # National swing over the districts with results in both elections, so
+    # a partial count is compared with the same districts four years ago
+    both = (current.values.sum(axis=1) > 0) & (previous.values.sum(axis=1) > 0)
+    national = pd.DataFrame({
+        'current': _shares(current.values[both].sum(axis=0, keepdims=True))[0],
+        'previous': _shares(previous.values[both].sum(axis=0, keepdims=True))[0],
+    }, index=pd.Index(current.parties, name='Gruppenname'))
+    national['swing'] = national['current'] - national['previous']
+
+    # Uniform swing: previous district shares plus the national swing
+    projected = np.nan_to_num(previous_shares) + np.nan_to_num(national['swing'].to_numpy())
+    projected = np.where(previous.values.sum(axis=1, keepdims=True) > 0, np.clip(projected, 0, None), 0)
+
+    for array in (current_shares, previous_shares, swing):
+        array.setflags(write=False)
+    return SwingAnalysis(
+        districts=current.districts,
+        parties=current.parties,
+        current=current_shares,
+        previous=previous_shares,
+        swing=swing,
+        winners=find_winners(current),
+        previous_winners=find_winners(previous),
+        national=national,
+        projected_winners=find_winners(replace(previous, values=projected)),
+    )
+
+
+def get_swing(stimme, snapshot=None):
+    """SwingAnalysis of the first (1) or second (2) votes (shared, do not modify)"""
+    snapshot = snapshot or newest_snapshot()
+    return _get_swing(stimme, snapshot, snapshot_version(snapshot))
+
+@st.cache_resource(max_entries=2 * RETAINED_SNAPSHOTS)
+def _get_swing(stimme, snapshot, version):
+    return build_swing(get_first_votes(snapshot) if stimme == 1 else get_second_votes(snapshot))
@@ -1,3 +1,5 @@
+from utils.matrix import build_vote_matrix, find_winners
+
 party_to_color = {
     'CDU': '#000000',
     'SPD': '#E3000F',
@@ -34,38 +36,10 @@ party_to_color = {
 
 
 def get_map_colors(df):
-    def result_to_color(result):
-        # are results already available?
-        if result.Anzahl.sum() > 0:
-            # Get the party with maximum votes
-            max_party = result[result.Anzahl == result.Anzahl.max()].Gruppenname.iloc[0]
-            
-            # Handle Einzelbewerber (EB:*) cases
-            if max_party.startswith('EB:'):
-                return party_to_color['EB']
-                
-            # Return the color for the winning party
-            return party_to_color[max_party]
-        else:
-            return '#808080'  # Return a grey color when no results available
-
-
-    colors = df.groupby('Gebietsnummer').apply(result_to_color)
-    return colors
+    # Colors of the winning party, grey when no results are available
+    # (party_to_color maps "EB" and "Keine Ergebnisse" as well)
+    return get_winner_party(df).map(party_to_color)
 
 def get_winner_party(df):
-    def get_winner(result):
-        # Check if results are available
-        if result.Anzahl.sum() > 0:
-            # Get the party with maximum votes
-            max_party = result[result.Anzahl == result.Anzahl.max()].Gruppenname.iloc[0]
-            
-            # Handle Einzelbewerber (EB:*) cases
-            if max_party.startswith('EB:'):
-                return 'EB'
-            return max_party
-        else:
-            return 'Keine Ergebnisse'  # Return message when no results available
-            
-    winners = df.groupby('Gebietsnummer').apply(get_winner)
-    return winners
\ No newline at end of file
+    winners = find_winners(build_vote_matrix(df))
+    return winners['label']